@@ -0,0 +1,120 @@
+import statistics
+import sys
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from bson import ObjectId
+from flask_admin import Admin
+from flask_admin.contrib.pymongo import ModelView
+
+from obeyd.admin import ActivityView, JokeViewForm, JokeViewView, app, db
+from obeyd.db import INDEXES, is_scratch_db
+
+
+class SkipJokeViewView(ModelView):
+    # how the joke_views list paged before, with skip/limit and an exact count
+    column_list = ("user_id", "joke_id", "score", "viewed_at", "scored_at")
+    column_default_sort = ("viewed_at", True)
+    form = JokeViewForm
+
+
+def seed(rows: int):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for collection in ["joke_views", "activities"]:
+        db[collection].drop()
+        db[collection].create_indexes(INDEXES[collection])
+
+    batch_size = 10_000
+    for offset in range(0, rows, batch_size):
+        at = [start + timedelta(seconds=i) for i in range(offset, offset + batch_size)]
+        db["joke_views"].insert_many(
+            [
+                {
+                    "user_id": i % 5000,
+                    "joke_id": ObjectId(),
+                    "score": None,
+                    "viewed_at": at[i - offset],
+                    "scored_at": None,
+                }
+                for i in range(offset, min(offset + batch_size, rows))
+            ],
+            ordered=False,
+        )
+        db["activities"].insert_many(
+            [
+                {"kind": "joke", "user_id": i % 5000, "created_at": at[i - offset]}
+                for i in range(offset, min(offset + batch_size, rows))
+            ],
+            ordered=False,
+        )
+
+
+def cursor_at(collection: str, column: str, position: int) -> str:
+    row = db[collection].find_one({}, sort=[(column, -1), ("_id", -1)], skip=position)
+    assert row is not None
+    return f"{row[column].replace(tzinfo=None).isoformat()}_{row['_id']}"
+
+
+def timed(client, url: str, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        response = client.get(url)
+        timings.append(perf_counter() - start)
+        if response.status_code != 200:
+            raise Exception(f"expected 200 from {url}, got {response.status_code}")
+    return statistics.median(timings)
+
+
+def main(rows: int = 1_000_000, repeat: int = 5, max_ms: int = 50):
+    # this writes to and then drops joke_views and activities
+    if not is_scratch_db():
+        raise Exception("expected MONGODB_URI to point at a *bench* or *test* database")
+
+    seed(rows)
+
+    admin = Admin(app, url="/")
+    admin.add_view(JokeViewView(db["joke_views"], endpoint="keyset_views"))
+    admin.add_view(ActivityView(db["activities"], endpoint="keyset_activities"))
+    admin.add_view(SkipJokeViewView(db["joke_views"], endpoint="skip_views"))
+    client = app.test_client()
+
+    page = 500
+    position = page * 20
+    views_cursor = cursor_at("joke_views", "viewed_at", position)
+    activities_cursor = cursor_at("activities", "created_at", position)
+    cases = [
+        ("skip joke_views, first page", "/skip_views/"),
+        (f"skip joke_views, page {page}", f"/skip_views/?page={page}"),
+        ("keyset joke_views, first page", "/keyset_views/"),
+        (f"keyset joke_views, page {page}", f"/keyset_views/?after={views_cursor}"),
+        ("keyset joke_views, user filter", "/keyset_views/?flt0_0=42"),
+        ("keyset activities, first page", "/keyset_activities/"),
+        (
+            f"keyset activities, page {page}",
+            f"/keyset_activities/?after={activities_cursor}",
+        ),
+        ("keyset activities, user filter", "/keyset_activities/?flt0_0=42"),
+    ]
+
+    print(f"{rows} rows, median of {repeat}")
+    results = {}
+    for name, url in cases:
+        results[name] = timed(client, url, repeat) * 1000
+        print(f"{name:>34}: {results[name]:8.2f}ms")
+
+    for collection in ["joke_views", "activities"]:
+        db[collection].drop()
+
+    # keyset pages cost the same however deep they are, skip pages do not
+    slow = [
+        name
+        for name, ms in results.items()
+        if name.startswith("keyset") and ms > max_ms
+    ]
+    if slow:
+        raise Exception(f"expected keyset pages under {max_ms}ms, got {slow}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
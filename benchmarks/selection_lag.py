@@ -0,0 +1,62 @@
+import asyncio
+import sys
+from time import perf_counter
+
+import numpy as np
+from bson import ObjectId
+
+from obeyd.jokes.executor import SelectionExecutor
+from obeyd.jokes.seen import SeenSet
+from obeyd.jokes.thompson import sample_joke
+from obeyd.metrics import LoopLagMonitor
+
+
+def catalog_of(n_arms: int):
+    rng = np.random.default_rng(0)
+    results = [{"_id": ObjectId(), "seq": i} for i in range(n_arms)]
+    seqs = np.arange(n_arms, dtype=np.int64)
+    counts = rng.integers(0, 50, size=n_arms).astype(np.float64)
+    moments = np.vstack([counts, counts * 3, counts * 10])
+    seen = SeenSet.from_seqs(rng.choice(n_arms, size=n_arms // 10).tolist())
+    return results, seqs, moments, seen
+
+
+async def measure(executor: SelectionExecutor, catalog, picks: int, concurrency: int):
+    monitor = LoopLagMonitor(interval=0.001)
+    ticker = asyncio.create_task(monitor.run())
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def pick():
+        async with semaphore:
+            await executor.run(sample_joke, *catalog)
+            # stands in for the i/o the handler does between picks
+            await asyncio.sleep(0.001)
+
+    start = perf_counter()
+    await asyncio.gather(*[pick() for _ in range(picks)])
+    elapsed = perf_counter() - start
+
+    ticker.cancel()
+    await asyncio.gather(ticker, return_exceptions=True)
+    executor.shutdown()
+    return picks / elapsed, monitor.metrics()
+
+
+async def main(picks: int = 200, concurrency: int = 8):
+    print(f"{picks} picks, {concurrency} at a time")
+    for n_arms in [10_000, 100_000]:
+        catalog = catalog_of(n_arms)
+        for workers in [0, 2, 4]:
+            rate, lag = await measure(
+                SelectionExecutor(workers), catalog, picks, concurrency
+            )
+            name = "inline" if workers == 0 else f"{workers} threads"
+            print(
+                f"{n_arms:>7} arms {name:>10}: {rate:7.0f} picks/s"
+                f"  loop lag mean {lag['mean_lag_ms']:6.2f}ms"
+                f"  max {lag['max_lag_ms']:6.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,144 @@
+import asyncio
+import platform
+import statistics
+import sys
+from datetime import datetime, timezone
+from time import perf_counter
+
+from bson import ObjectId
+
+from obeyd.db import client, create_indexes, db, is_scratch_db
+from obeyd.jokes.functions import record_joke_view
+from obeyd.jokes.stats import record_view_stats, user_average_score
+
+
+async def record_joke_view_serial(joke: dict, user_id: int, chat_id: int):
+    # the bookkeeping send_joke did before: two inserts, one after the other
+    await db["joke_views"].insert_one(
+        {
+            "user_id": user_id,
+            "joke_id": joke["_id"],
+            "score": None,
+            "viewed_at": datetime.now(tz=timezone.utc),
+            "scored_at": None,
+        }
+    )
+    await db["joke_views_chat"].insert_one(
+        {
+            "chat_id": chat_id,
+            "joke_id": joke["_id"],
+            "viewed_at": datetime.now(tz=timezone.utc),
+        }
+    )
+
+
+async def record_joke_view_chained(joke: dict, user_id: int, chat_id: int):
+    # the user view as it was first made idempotent: average, upsert and
+    # observation one after the other, next to the chat view
+    async def record_user_view():
+        imputed_score = await user_average_score(user_id)
+        result = await db["joke_views"].update_one(
+            {"user_id": user_id, "joke_id": joke["_id"]},
+            {
+                "$setOnInsert": {
+                    "score": None,
+                    "imputed_score": imputed_score,
+                    "viewed_at": datetime.now(tz=timezone.utc),
+                    "scored_at": None,
+                }
+            },
+            upsert=True,
+        )
+        if result.upserted_id is not None:
+            await record_view_stats(joke["_id"], imputed_score)
+
+    await asyncio.gather(
+        record_user_view(),
+        db["joke_views_chat"].update_one(
+            {"chat_id": chat_id, "joke_id": joke["_id"]},
+            {"$setOnInsert": {"viewed_at": datetime.now(tz=timezone.utc)}},
+            upsert=True,
+        ),
+    )
+
+
+async def send_and_record_serial(
+    joke: dict, user_id: int, chat_id: int, latency: float
+):
+    await asyncio.sleep(latency)
+    await record_joke_view_serial(joke, user_id, chat_id)
+
+
+async def send_and_record_chained(
+    joke: dict, user_id: int, chat_id: int, latency: float
+):
+    await asyncio.sleep(latency)
+    await record_joke_view_chained(joke, user_id, chat_id)
+
+
+async def send_and_record(joke: dict, user_id: int, chat_id: int, latency: float):
+    # as send_joke does it, the average is read during the send
+    imputed_score, _ = await asyncio.gather(
+        user_average_score(user_id), asyncio.sleep(latency)
+    )
+    await record_joke_view(joke, user_id, chat_id, imputed_score)
+
+
+async def measure(record, deliveries: int, latency: float) -> list[float]:
+    # a telegram send is simulated with a sleep and subtracted from the
+    # timings, what is left is the time the database adds to a delivery
+    timings = []
+    for i in range(deliveries):
+        joke = {"_id": ObjectId(), "seq": i}
+        user_id = 1000 + i
+        # viewers with a score history, so views are counted as observations
+        await db["user_score_stats"].update_one(
+            {"user_id": user_id}, {"$set": {"count": 4, "sum": 12}}, upsert=True
+        )
+        start = perf_counter()
+        await record(joke, user_id, -1000 - i, latency)
+        timings.append(perf_counter() - start - latency)
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95)]
+    print(
+        f"{name:>10}: mean {statistics.mean(timings) * 1000:.2f}ms"
+        f"  p50 {statistics.median(timings) * 1000:.2f}ms"
+        f"  p95 {p95 * 1000:.2f}ms"
+    )
+
+
+async def main(deliveries: int = 500, latency_ms: int = 50):
+    latency = latency_ms / 1000
+
+    # this writes to and then drops the view collections
+    if not is_scratch_db():
+        raise Exception("expected MONGODB_URI to point at a *bench* or *test* database")
+
+    await create_indexes()
+
+    # results are only comparable with the server and host they came from
+    server = await client.server_info()
+    print(
+        f"mongodb {server['version']}, python {platform.python_version()},"
+        f" {platform.machine()}, {deliveries} deliveries, {latency_ms}ms send"
+    )
+    report("serial", await measure(send_and_record_serial, deliveries, latency))
+    report("chained", await measure(send_and_record_chained, deliveries, latency))
+    report("overlapped", await measure(send_and_record, deliveries, latency))
+
+    for collection in [
+        "joke_views",
+        "joke_views_chat",
+        "joke_stats",
+        "user_score_stats",
+        "seen_jokes",
+    ]:
+        await db[collection].drop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,91 @@
+import platform
+import sys
+import timeit
+
+import numpy as np
+
+from obeyd.jokes.thompson import ThompsonSampling
+
+
+class ListThompsonSampling:
+    # the list-backed engine ThompsonSampling replaced, kept for comparison
+    def __init__(self, n_arms, default_mean: float, default_var: float):
+        self.n_arms = n_arms
+        self.observations = {i: [] for i in range(self.n_arms)}
+        self.default_mean = default_mean
+        self.default_var = default_var
+
+    def select_arm(self):
+        means = np.array(
+            [
+                (
+                    np.mean(self.observations[i])
+                    if self.observations[i]
+                    else self.default_mean
+                )
+                for i in range(self.n_arms)
+            ]
+        )
+        vars = np.array(
+            [
+                (
+                    np.var(self.observations[i])
+                    if self.observations[i]
+                    else self.default_var
+                )
+                for i in range(self.n_arms)
+            ]
+        )
+
+        sampled_values = np.random.normal(means, np.sqrt(vars))
+        return np.argmax(sampled_values)
+
+    def insert_observation(self, chosen_arm, value):
+        self.observations[chosen_arm].append(value)
+
+
+def observations(n_arms: int, views_per_arm: int):
+    rng = np.random.default_rng(0)
+    arms = np.repeat(np.arange(n_arms), views_per_arm)
+    values = rng.integers(1, 6, size=len(arms)).astype(np.float64)
+    return arms, values
+
+
+def bench_list(n_arms: int, arms, values, repeat: int):
+    def run():
+        thompson = ListThompsonSampling(n_arms, default_mean=3.0, default_var=2.0)
+        for arm, value in zip(arms.tolist(), values.tolist()):
+            thompson.insert_observation(arm, value)
+        thompson.select_arm()
+
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def bench_array(n_arms: int, arms, values, repeat: int):
+    def run():
+        thompson = ThompsonSampling(n_arms, default_mean=3.0, default_var=2.0)
+        thompson.insert_many(arms, values)
+        thompson.select_arm()
+
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main(views_per_arm: int = 5, repeat: int = 3):
+    print(
+        f"python {platform.python_version()}, numpy {np.__version__},"
+        f" {platform.processor() or platform.machine()}, {views_per_arm} views per arm,"
+        f" best of {repeat}"
+    )
+    print(f"{'arms':>8} {'list (ms)':>12} {'array (ms)':>12} {'speedup':>9}")
+    for n_arms in [1_000, 10_000, 100_000]:
+        arms, values = observations(n_arms, views_per_arm)
+        list_time = bench_list(n_arms, arms, values, repeat)
+        array_time = bench_array(n_arms, arms, values, repeat)
+        print(
+            f"{n_arms:>8} {list_time * 1000:>12.2f} {array_time * 1000:>12.2f}"
+            f" {list_time / array_time:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
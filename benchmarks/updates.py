@@ -0,0 +1,120 @@
+import asyncio
+import sys
+from datetime import datetime, timezone
+from time import perf_counter
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import BaseUpdateProcessor, SimpleUpdateProcessor
+
+from obeyd.updates import KeyedUpdateProcessor
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update(
+        update_id,
+        message=Message(
+            update_id,
+            datetime.now(tz=timezone.utc),
+            Chat(chat_id, Chat.PRIVATE),
+            from_user=User(chat_id, "bench", False),
+            text="/joke",
+        ),
+    )
+
+
+async def measure(
+    processor: BaseUpdateProcessor, chats: int, per_chat: int, latency: float
+) -> float:
+    handled: dict[int, list[int]] = {}
+
+    async def handler(update: Update):
+        # stands in for a handler waiting on telegram, e.g. a media upload
+        await asyncio.sleep(latency)
+        assert update.effective_chat
+        handled.setdefault(update.effective_chat.id, []).append(update.update_id)
+
+    # interleave chats the way updates arrive from telegram
+    updates = [
+        make_update(i * chats + chat, chat)
+        for i in range(per_chat)
+        for chat in range(chats)
+    ]
+
+    start = perf_counter()
+    async with processor:
+        # the application starts one task per update in arrival order
+        await asyncio.gather(
+            *[processor.process_update(update, handler(update)) for update in updates]
+        )
+    elapsed = perf_counter() - start
+
+    if isinstance(processor, KeyedUpdateProcessor):
+        for chat_updates in handled.values():
+            if chat_updates != sorted(chat_updates):
+                raise Exception("expected updates of a chat to be handled in order")
+
+    return len(updates) / elapsed
+
+
+async def measure_starvation(
+    processor: BaseUpdateProcessor, hot_updates: int, latency: float
+) -> float:
+    # one chat floods the bot, how long does a single update of another wait
+    async def handler(update: Update):
+        await asyncio.sleep(latency)
+
+    hot = [make_update(i, 1) for i in range(hot_updates)]
+    cold = make_update(hot_updates, 2)
+    cold_wait = 0.0
+
+    async def cold_handler(update: Update):
+        nonlocal cold_wait
+        cold_wait = perf_counter() - start
+        await handler(update)
+
+    async with processor:
+        tasks = [
+            asyncio.create_task(processor.process_update(update, handler(update)))
+            for update in hot
+        ]
+        await asyncio.sleep(0)
+        start = perf_counter()
+        tasks.append(
+            asyncio.create_task(processor.process_update(cold, cold_handler(cold)))
+        )
+        await asyncio.gather(*tasks)
+
+    return cold_wait
+
+
+async def main(per_chat: int = 20, latency: float = 0.01, concurrency: int = 64):
+    print(f"{per_chat} updates per chat, {latency * 1000:.0f}ms per update")
+    for chats in [1, 8, 64]:
+        sequential = await measure(SimpleUpdateProcessor(1), chats, per_chat, latency)
+        keyed = await measure(
+            KeyedUpdateProcessor(concurrency), chats, per_chat, latency
+        )
+        print(
+            f"{chats:>3} chats: sequential {sequential:8.0f} updates/s"
+            f"  keyed {keyed:8.0f} updates/s  ({keyed / sequential:.1f}x)"
+        )
+
+    hot_updates = concurrency * 3
+    cold_wait = await measure_starvation(
+        KeyedUpdateProcessor(concurrency), hot_updates, latency
+    )
+    print(
+        f"{hot_updates} queued updates of one chat: an update of another chat"
+        f" waited {cold_wait * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(
+        main(
+            per_chat=int(args[0]) if len(args) > 0 else 20,
+            latency=float(args[1]) if len(args) > 1 else 0.01,
+            concurrency=int(args[2]) if len(args) > 2 else 64,
+        )
+    )
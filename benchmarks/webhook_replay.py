@@ -0,0 +1,76 @@
+import asyncio
+import json
+import os
+import statistics
+import sys
+from collections import Counter
+from time import perf_counter
+
+import httpx
+
+
+async def replay(
+    url: str, updates: list[dict], repeat: int, concurrency: int, secret_token: str
+):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses: Counter[int] = Counter()
+    timings: list[float] = []
+
+    async def post(client: httpx.AsyncClient, update: dict):
+        async with semaphore:
+            start = perf_counter()
+            response = await client.post(
+                url,
+                json=update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": secret_token},
+            )
+            timings.append(perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    start = perf_counter()
+    async with httpx.AsyncClient() as client:
+        await asyncio.gather(
+            *[
+                # every replayed copy gets its own update_id, like telegram's
+                post(client, {**update, "update_id": update["update_id"] + i * 10**6})
+                for i in range(repeat)
+                for update in updates
+            ]
+        )
+    elapsed = perf_counter() - start
+
+    timings.sort()
+    print(
+        f"{len(timings)} posts in {elapsed:.2f}s ({len(timings) / elapsed:.0f}/s)"
+        f"  p50 {statistics.median(timings) * 1000:.2f}ms"
+        f"  p95 {timings[int(len(timings) * 0.95)] * 1000:.2f}ms"
+    )
+    for status, count in sorted(statuses.items()):
+        print(f"  {status}: {count}")
+
+
+def main():
+    # posts recorded updates (one json object per line) to a running webhook,
+    # 503s show where the ingestion queue started shedding
+    args = sys.argv[1:]
+    if len(args) < 2:
+        raise Exception(
+            "expected arguments: <url> <updates.jsonl> [repeat] [concurrency]"
+        )
+
+    with open(args[1]) as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+
+    asyncio.run(
+        replay(
+            url=args[0],
+            updates=updates,
+            repeat=int(args[2]) if len(args) > 2 else 1,
+            concurrency=int(args[3]) if len(args) > 3 else 10,
+            secret_token=os.environ.get("OBEYD_WEBHOOK_SECRET_TOKEN", ""),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,136 @@
+import asyncio
+import logging
+import random
 from datetime import datetime, timezone
+from time import monotonic
 from typing import Any, Optional
 
+from pymongo.errors import BulkWriteError
 from telegram import Update
 
+from obeyd.config import (
+    ACTIVITY_BATCH_SIZE,
+    ACTIVITY_FLUSH_INTERVAL,
+    ACTIVITY_QUEUE_SIZE,
+    ACTIVITY_SAMPLE_RATE,
+)
 from obeyd.db import db
+from obeyd.rollups import record_rollups
 
+logger = logging.getLogger(__name__)
 
-async def log_activity_custom(
+
+class ActivitySink:
+    def __init__(
+        self,
+        maxsize: int,
+        batch_size: int,
+        flush_interval: float,
+        sample_rate: float,
+    ):
+        self.queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        # once the queue is this full, only a sample of activities is kept
+        self.high_water = int(maxsize * 0.8)
+        self.task: asyncio.Task | None = None
+        self.stopping = False
+
+        self.written = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    def enqueue(self, activity: dict[str, Any]):
+        if self.queue.qsize() >= self.high_water:
+            if random.random() >= self.sample_rate:
+                self.sampled_out += 1
+                return
+            # a kept activity stands for the ones sampled out next to it
+            activity["sample_weight"] = 1 / self.sample_rate
+
+        try:
+            self.queue.put_nowait(activity)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        self.stopping = False
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.stopping = True
+        if self.task is not None:
+            await self.task
+            self.task = None
+
+    async def run(self):
+        while not (self.stopping and self.queue.empty()):
+            batch = []
+            deadline = monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - monotonic()
+                if self.stopping or timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            if batch:
+                await self.write(batch)
+
+    async def write(self, batch: list[dict[str, Any]]):
+        # a batch that fails for any reason (e.g. an activity bson can't
+        # encode) is dropped, the sink keeps running for the next one
+        try:
+            await db["activities"].insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            # unordered, so everything but the failed documents was inserted
+            failed = {error["index"] for error in e.details["writeErrors"]}
+            self.written += e.details["nInserted"]
+            self.failed += len(batch) - e.details["nInserted"]
+            logger.exception(
+                f"failed to write {len(failed)} of {len(batch)} activities"
+            )
+            batch = [a for i, a in enumerate(batch) if i not in failed]
+        except Exception:
+            self.failed += len(batch)
+            logger.exception(f"failed to write {len(batch)} activities")
+            return
+
+        try:
+            await record_rollups(batch)
+        except Exception:
+            logger.exception(f"failed to roll up {len(batch)} activities")
+
+
+activity_sink = ActivitySink(
+    maxsize=ACTIVITY_QUEUE_SIZE,
+    batch_size=ACTIVITY_BATCH_SIZE,
+    flush_interval=ACTIVITY_FLUSH_INTERVAL,
+    sample_rate=ACTIVITY_SAMPLE_RATE,
+)
+
+
+def log_activity_custom(
     update: Update, kind: str, data: Optional[dict[str, Any]] = None
 ):
-    await db["activities"].insert_one(
+    activity_sink.enqueue(
         {
             "kind": kind,
             "user_id": (
@@ -1,6 +1,9 @@
 import os
+from datetime import datetime
 
-from flask import Flask
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Flask, request
 from flask_admin import Admin
 from flask_admin.contrib.pymongo import ModelView
 from flask_admin.contrib.pymongo.filters import (
@@ -8,9 +11,11 @@ from flask_admin.contrib.pymongo.filters import (
     FilterEqual,
     FilterLike,
 )
-from pymongo import MongoClient
+from pymongo import ASCENDING, DESCENDING, MongoClient
 from wtforms import fields, form
 
+from obeyd.hll import hll_estimate
+
 db_uri = os.environ["MONGODB_URI"]
 client = MongoClient(db_uri.rsplit("/", 1)[0])
 db = client[db_uri.rsplit("/", 1)[1]]
@@ -20,6 +25,114 @@ app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ["FLASK_SECRET_KEY"]
 
 
+class IntEqualFilter(FilterEqual):
+    def clean(self, value):
+        return int(value)
+
+
+class ObjectIdEqualFilter(FilterEqual):
+    def clean(self, value):
+        return ObjectId(value)
+
+
+class KeysetModelView(ModelView):
+    # pages by the last row shown instead of skip/limit and never counts
+    # exactly, for collections too large for either. rows are ordered by
+    # keyset_column (newest first) with _id breaking ties, both must be
+    # covered by an index, as must every filter
+    keyset_column = "created_at"
+    list_template = "admin/keyset_list.html"
+    simple_list_pager = True
+    column_sortable_list = ()
+
+    def estimated_count(self) -> int:
+        return self.coll.estimated_document_count()
+
+    def encode_cursor(self, row: dict) -> str:
+        # rows missing the keyset column sort as null, after every dated row
+        value = row.get(self.keyset_column)
+        return f"{value.isoformat() if value is not None else ''}_{row['_id']}"
+
+    def decode_cursor(self, cursor: str) -> tuple[datetime | None, ObjectId] | None:
+        try:
+            value, _id = cursor.rsplit("_", 1)
+            return datetime.fromisoformat(value) if value else None, ObjectId(_id)
+        except (ValueError, InvalidId):
+            return None
+
+    def keyset_query(self, key: tuple[datetime | None, ObjectId], op: str) -> dict:
+        value, _id = key
+        column = self.keyset_column
+        # nulls sort below every date but comparisons never match them, so
+        # they are added explicitly on the way down and up
+        if value is None:
+            if op == "$lt":
+                return {column: None, "_id": {op: _id}}
+            return {
+                "$or": [
+                    {column: {"$ne": None}},
+                    {column: None, "_id": {op: _id}},
+                ]
+            }
+        return {
+            "$or": [
+                {column: {op: value}},
+                {column: value, "_id": {op: _id}},
+                *([{column: None}] if op == "$lt" else []),
+            ]
+        }
+
+    def get_list(
+        self,
+        page,
+        sort_column,
+        sort_desc,
+        search,
+        filters,
+        execute=True,
+        page_size=None,
+    ):
+        conditions = []
+        for flt, _, value in filters or []:
+            f = self._filters[flt]
+            conditions = f.apply(conditions, f.clean(value))
+
+        # rows older than the last one shown, or newer than the first one,
+        # a cursor that does not decode (an edited url) shows the first page
+        after = self.decode_cursor(request.args.get("after") or "")
+        before = self.decode_cursor(request.args.get("before") or "")
+        direction = DESCENDING
+        if after is not None:
+            conditions.append(self.keyset_query(after, "$lt"))
+        elif before is not None:
+            conditions.append(self.keyset_query(before, "$gt"))
+            direction = ASCENDING
+
+        query = {"$and": conditions} if conditions else {}
+        results = list(
+            self.coll.find(
+                query,
+                sort=[(self.keyset_column, direction), ("_id", direction)],
+                limit=page_size or self.page_size,
+            )
+        )
+        if direction == ASCENDING:
+            results.reverse()
+
+        return None, results
+
+    def keyset_url(self, direction: str | None = None, row: dict | None = None):
+        view_args = self._get_list_extra_args()
+        extra_args = {
+            k: v
+            for k, v in view_args.extra_args.items()
+            if k not in ("after", "before")
+        }
+        if direction is not None and row is not None:
+            extra_args[direction] = self.encode_cursor(row)
+        return self._get_list_url(view_args.clone(page=None, extra_args=extra_args))
+
+
 class UserForm(form.Form):
     user_id = fields.IntegerField()
     user_name = fields.StringField()
@@ -90,7 +203,8 @@ class JokeViewForm(form.Form):
     creator_nickname = fields.StringField()
 
 
-class JokeViewView(ModelView):
+class JokeViewView(KeysetModelView):
+    keyset_column = "viewed_at"
     column_list = (
         "user_id",
         "joke_id",
@@ -99,12 +213,9 @@ class JokeViewView(ModelView):
         "scored_at",
     )
     column_filters = [
-        FilterEqual("user_id", "User ID"),
-        FilterEqual("joke_id", "Joke ID"),
-        FilterEqual("score", "Score"),
+        IntEqualFilter("user_id", "User ID"),
+        ObjectIdEqualFilter("joke_id", "Joke ID"),
     ]
-    column_sortable_list = ["score", "viewed_at", "scored_at"]
-    column_default_sort = ("score", True)
     form = JokeViewForm
 
 
@@ -118,7 +229,8 @@ class ActivityForm(form.Form):
     created_at = fields.DateTimeField()
 
 
-class ActivityView(ModelView):
+class ActivityView(KeysetModelView):
+    keyset_column = "created_at"
     column_list = (
         "kind",
         "user_id",
@@ -129,17 +241,110 @@ class ActivityView(ModelView):
         "data",
         "created_at",
     )
+    column_filters = [
+        IntEqualFilter("user_id", "User ID"),
+    ]
+    form = ActivityForm
+
+
+class ActivityRollupForm(form.Form):
+    kind = fields.StringField()
+    chat_type = fields.StringField()
+    granularity = fields.StringField()
+    bucket = fields.DateTimeField()
+    count = fields.FloatField()
+
+
+class ActivityRollupView(ModelView):
+    can_create = False
+    can_edit = False
+    can_delete = False
+
+    column_list = (
+        "kind",
+        "chat_type",
+        "granularity",
+        "bucket",
+        "count",
+        "unique_users",
+    )
+    column_formatters = {
+        "count": lambda v, c, m, n: round(m.get("count", 0)),
+        "unique_users": lambda v, c, m, n: round(hll_estimate(m.get("hll", {}))),
+    }
     column_filters = [
         FilterEqual("kind", "Kind"),
-        FilterEqual("user_id", "User ID"),
-        FilterLike("user_name", "User Name"),
         FilterEqual("chat_type", "Chat Type"),
-        FilterEqual("chat_id", "Chat ID"),
-        FilterLike("chat_name", "Chat Name"),
+        FilterEqual("granularity", "Granularity"),
     ]
-    column_sortable_list = ["created_at"]
-    column_default_sort = ("created_at", True)
-    form = ActivityForm
+    column_sortable_list = ["bucket", "count"]
+    column_default_sort = ("bucket", True)
+    form = ActivityRollupForm
+
+
+class JokeLeaderboardForm(form.Form):
+    views = fields.IntegerField()
+    votes = fields.IntegerField()
+    mean = fields.FloatField()
+    bayesian_score = fields.FloatField()
+
+
+def joke_preview(joke_id, joke: dict | None) -> str:
+    if joke is None:
+        return str(joke_id)
+    text = joke.get("text") or ""
+    return f"[{joke['kind']}] {text[:80]}"
+
+
+class JokeLeaderboardView(ModelView):
+    # refreshed from joke_views by the bot, edits here would be overwritten
+    can_create = False
+    can_edit = False
+    can_delete = False
+
+    column_list = (
+        "joke",
+        "views",
+        "votes",
+        "histogram",
+        "mean",
+        "bayesian_score",
+    )
+    column_formatters = {
+        "joke": lambda v, c, m, n: m.get("joke_preview", ""),
+        "histogram": lambda v, c, m, n: " ".join(
+            f"{score}:{count}" for score, count in m.get("histogram", {}).items()
+        ),
+        "mean": lambda v, c, m, n: (
+            round(m["score_sum"] / m["votes"], 2) if m.get("votes") else None
+        ),
+        "bayesian_score": lambda v, c, m, n: round(m.get("bayesian_score", 0), 2),
+    }
+    column_filters = [
+        ObjectIdEqualFilter("joke_id", "Joke ID"),
+    ]
+    column_sortable_list = ["views", "votes", "mean", "bayesian_score"]
+    column_default_sort = ("bayesian_score", True)
+    form = JokeLeaderboardForm
+
+    def get_list(self, *args, **kwargs):
+        count, results = super().get_list(*args, **kwargs)
+        results = list(results)
+
+        # the jokes of the whole page in one query
+        jokes = {
+            joke["_id"]: joke
+            for joke in db["jokes"].find(
+                {"_id": {"$in": [row["joke_id"] for row in results]}},
+                {"kind": 1, "text": 1},
+            )
+        }
+        for row in results:
+            row["joke_preview"] = joke_preview(
+                row["joke_id"], jokes.get(row["joke_id"])
+            )
+
+        return count, results
 
 
 class RecurringForm(form.Form):
@@ -174,7 +379,9 @@ if __name__ == "__main__":
     admin.add_view(UserView(db["users"]))
     admin.add_view(JokeView(db["jokes"]))
     admin.add_view(JokeViewView(db["joke_views"]))
+    admin.add_view(JokeLeaderboardView(db["joke_leaderboard"], name="Joke Leaderboard"))
     admin.add_view(RecurringView(db["recurrings"]))
+    admin.add_view(ActivityRollupView(db["activity_rollups"], name="Activity Rollups"))
     admin.add_view(ActivityView(db["activities"]))
 
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -1,10 +1,13 @@
+import asyncio
 import logging
 import os
+import signal
 
 import sentry_sdk
 from telegram import KeyboardButton, ReplyKeyboardMarkup, Update
 from telegram.constants import ParseMode
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
@@ -16,20 +19,46 @@ from telegram.ext import (
     filters,
 )
 
+from obeyd.activities import activity_sink
 from obeyd.broadcast import (
     BROADCAST_CONFIRM,
     BROADCAST_TEXT,
     broadcast_handler,
     broadcast_handler_confirm,
     broadcast_handler_text,
+    resume_broadcasts,
 )
+from obeyd.config import (
+    ADMIN_REFRESH_INTERVAL,
+    INGEST_MODE,
+    INLINE_POOL_REFILL_INTERVAL,
+    LEADERBOARD_REFRESH_INTERVAL,
+    LEASE_TTL,
+    LOOP_LAG_INTERVAL,
+    METRICS_LOG_INTERVAL,
+    PERSISTENCE_FLUSH_INTERVAL,
+    SCORE_DIGEST_FLUSH_INTERVAL,
+    SEND_CHAT_RATE,
+    SEND_GLOBAL_RATE,
+    SEND_GROUP_RATE,
+    SEND_MAX_RETRIES,
+    UPDATE_CONCURRENCY,
+    WEBHOOK_PATH,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET_TOKEN,
+)
+from obeyd.db import create_indexes
 from obeyd.feedback import (
     FEEDBACK_STATES_FEEDBACK,
     feedback_handler,
     feedback_handler_feedback,
 )
+from obeyd.jokes.catalog import catalog, watch_catalog
+from obeyd.jokes.digest import flush_score_digests
+from obeyd.jokes.executor import selection_executor
 from obeyd.jokes.inline import inline_query_handler
 from obeyd.jokes.joke import joke_handler
+from obeyd.jokes.leaderboard import refresh_leaderboard_job, top_handler
 from obeyd.jokes.new import (
     NEWJOKE_STATES_JOKE,
     NEWJOKE_STATES_JOKE_TEXT,
@@ -37,16 +66,25 @@ from obeyd.jokes.new import (
     newjoke_handler_joke,
     newjoke_handler_joke_text,
 )
+from obeyd.jokes.pool import refill_inline_pool
 from obeyd.jokes.recurrings import (
     SETRECURRING_STATES_INTERVAL,
     deleterecurring_handler,
-    schedule_recurrings,
+    schedule_recurring_dispatchers,
     setrecurring_handler,
     setrecurring_handler_interval,
 )
 from obeyd.jokes.review import reviewjoke_callback_query_handler
 from obeyd.jokes.score import scorejoke_callback_query_handler
+from obeyd.jokes.seen import backfill_seen_sets, watch_seen_jokes
+from obeyd.jokes.stats import backfill_stats, joke_stats_table, watch_joke_stats
+from obeyd.lease import claim_ingestion, ingest_lease, keep_ingestion, keep_leadership
+from obeyd.metrics import LoopLagMonitor, log_metrics, register_metrics
 from obeyd.middlewares import log_activity
+from obeyd.persistence import MongoPersistence, SharedConversationHandler
+from obeyd.sender import PriorityRateLimiter
+from obeyd.updates import KeyedUpdateProcessor
+from obeyd.user_cache import admin_cache, refresh_admins, user_cache, watch_users
 from obeyd.users import (
     SETNAME_STATES_NAME,
     START_STATES_NAME,
@@ -55,6 +93,7 @@ from obeyd.users import (
     setname_handler_name,
     start_handler,
 )
+from obeyd.webhook import WebhookIngest, run_webhook
 
 
 @log_activity("cancel")
@@ -77,6 +116,58 @@ async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+background_tasks: list[asyncio.Task] = []
+loop_lag = LoopLagMonitor(LOOP_LAG_INTERVAL)
+
+
+async def post_init(app: Application):
+    await create_indexes()
+    if INGEST_MODE != "none":
+        await claim_ingestion()
+        background_tasks.append(asyncio.create_task(keep_ingestion()))
+    activity_sink.start()
+    await catalog.reload()
+    await backfill_stats()
+    await backfill_seen_sets()
+    await joke_stats_table.reload()
+    await admin_cache.refresh()
+    background_tasks.append(asyncio.create_task(watch_catalog()))
+    background_tasks.append(asyncio.create_task(watch_joke_stats()))
+    background_tasks.append(asyncio.create_task(watch_users()))
+    background_tasks.append(asyncio.create_task(watch_seen_jokes()))
+    background_tasks.append(asyncio.create_task(keep_leadership()))
+    if isinstance(app.persistence, MongoPersistence):
+        background_tasks.append(asyncio.create_task(app.persistence.watch()))
+    background_tasks.append(asyncio.create_task(loop_lag.run()))
+
+
+async def post_shutdown(app: Application):
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await ingest_lease.release()
+    await activity_sink.stop()
+    selection_executor.shutdown()
+
+
+async def run_worker(app: Application):
+    # scheduled work only, the updates are taken by the ingesting instance
+    stopping = asyncio.Event()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        asyncio.get_running_loop().add_signal_handler(sig, stopping.set)
+
+    async with app:
+        if app.post_init is not None:
+            await app.post_init(app)
+        await app.start()
+        try:
+            await stopping.wait()
+        finally:
+            await app.stop()
+            if app.post_shutdown is not None:
+                await app.post_shutdown(app)
+
+
 if __name__ == "__main__":
     if os.environ.get("SENTRY_ENABLED", "False") == "True":
         sentry_sdk.init(
@@ -92,12 +183,37 @@ if __name__ == "__main__":
 
     defaults = Defaults(parse_mode=ParseMode.HTML)
 
+    rate_limiter = PriorityRateLimiter(
+        global_rate=SEND_GLOBAL_RATE,
+        chat_rate=SEND_CHAT_RATE,
+        group_rate=SEND_GROUP_RATE,
+        max_retries=SEND_MAX_RETRIES,
+    )
+    update_processor = KeyedUpdateProcessor(UPDATE_CONCURRENCY)
+    persistence = MongoPersistence(update_interval=PERSISTENCE_FLUSH_INTERVAL)
+    register_metrics("sender", rate_limiter.metrics)
+    register_metrics("updates", update_processor.metrics)
+    register_metrics("persistence", persistence.metrics)
+    register_metrics("activities", activity_sink.metrics)
+    register_metrics("user_cache", user_cache.stats)
+    register_metrics("selection", selection_executor.metrics)
+    register_metrics("loop", loop_lag.metrics)
+
+    builder = ApplicationBuilder()
+    if INGEST_MODE == "webhook":
+        # bounded, so that a backlog is shed at the webhook instead of piling up
+        builder = builder.update_queue(asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE))
+
     app = (
-        ApplicationBuilder()
-        .read_timeout(30)
+        builder.read_timeout(30)
         .write_timeout(30)
         .token(os.environ["API_TOKEN"])
         .defaults(defaults)
+        .rate_limiter(rate_limiter)
+        .concurrent_updates(update_processor)
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
     job_queue = app.job_queue
@@ -105,7 +221,9 @@ if __name__ == "__main__":
 
     app.add_handler(CommandHandler("start", start_handler))
     app.add_handler(
-        ConversationHandler(
+        SharedConversationHandler(
+            name="feedback",
+            persistent=True,
             entry_points=[CommandHandler("feedback", feedback_handler)],  # type: ignore
             states={
                 FEEDBACK_STATES_FEEDBACK: [
@@ -118,7 +236,9 @@ if __name__ == "__main__":
         )
     )
     app.add_handler(
-        ConversationHandler(
+        SharedConversationHandler(
+            name="setname",
+            persistent=True,
             entry_points=[CommandHandler("setname", setname_handler)],  # type: ignore
             states={
                 SETNAME_STATES_NAME: [
@@ -132,11 +252,14 @@ if __name__ == "__main__":
     )
     app.add_handler(CommandHandler("getname", getname_handler))  # type: ignore
     app.add_handler(CommandHandler("joke", joke_handler))  # type: ignore
+    app.add_handler(CommandHandler("top", top_handler))
     app.add_handler(
         CallbackQueryHandler(scorejoke_callback_query_handler, pattern="^scorejoke")
     )
     app.add_handler(
-        ConversationHandler(
+        SharedConversationHandler(
+            name="setrecurring",
+            persistent=True,
             entry_points=[CommandHandler("setrecurring", setrecurring_handler)],
             states={
                 SETRECURRING_STATES_INTERVAL: [
@@ -150,7 +273,9 @@ if __name__ == "__main__":
     )
     app.add_handler(CommandHandler("deleterecurring", deleterecurring_handler))
     app.add_handler(
-        ConversationHandler(
+        SharedConversationHandler(
+            name="newjoke",
+            persistent=True,
             entry_points=[CommandHandler("newjoke", newjoke_handler)],  # type: ignore
             states={
                 NEWJOKE_STATES_JOKE: [
@@ -174,7 +299,9 @@ if __name__ == "__main__":
         CallbackQueryHandler(reviewjoke_callback_query_handler, pattern="^reviewjoke")
     )
     app.add_handler(
-        ConversationHandler(
+        SharedConversationHandler(
+            name="broadcast",
+            persistent=True,
             entry_points=[CommandHandler("broadcast", broadcast_handler)],
             states={
                 BROADCAST_TEXT: [
@@ -192,6 +319,27 @@ if __name__ == "__main__":
         )
     )
 
-    job_queue.run_once(schedule_recurrings, when=0)
+    schedule_recurring_dispatchers(job_queue)
+    job_queue.run_repeating(resume_broadcasts, interval=LEASE_TTL)
+    job_queue.run_repeating(flush_score_digests, interval=SCORE_DIGEST_FLUSH_INTERVAL)
+    job_queue.run_repeating(
+        refresh_leaderboard_job, interval=LEADERBOARD_REFRESH_INTERVAL
+    )
+    job_queue.run_repeating(log_metrics, interval=METRICS_LOG_INTERVAL)
+    job_queue.run_repeating(refresh_admins, interval=ADMIN_REFRESH_INTERVAL)
+    job_queue.run_repeating(
+        refill_inline_pool, interval=INLINE_POOL_REFILL_INTERVAL, first=0
+    )
 
-    app.run_polling()
+    if INGEST_MODE == "webhook":
+        ingest = WebhookIngest(app, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN)
+        register_metrics("webhook", ingest.metrics)
+        asyncio.run(run_webhook(app, ingest))
+    elif INGEST_MODE == "polling":
+        app.run_polling()
+    elif INGEST_MODE == "none":
+        asyncio.run(run_worker(app))
+    else:
+        raise Exception(
+            "expected OBEYD_INGEST_MODE to be one of 'polling', 'webhook' or 'none'"
+        )
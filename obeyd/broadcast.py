@@ -1,8 +1,27 @@
-from telegram import ReplyKeyboardMarkup, Update
+import asyncio
+import logging
+from datetime import datetime, timezone
+from time import monotonic
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
+from telegram.error import Forbidden, TelegramError
 from telegram.ext import ContextTypes, ConversationHandler
 
+from obeyd.config import (
+    BROADCAST_BATCH_SIZE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_PROGRESS_INTERVAL,
+    LEASE_RENEW_INTERVAL,
+    LEASE_TTL,
+)
 from obeyd.db import db
+from obeyd.lease import Lease, leader_only
 from obeyd.middlewares import admin_only
+from obeyd.sender import Priority
+
+logger = logging.getLogger(__name__)
 
 BROADCAST_TEXT = 1
 BROADCAST_CONFIRM = 2
@@ -45,29 +64,218 @@ async def broadcast_handler_confirm(update: Update, context: ContextTypes.DEFAUL
         await update.message.reply_text("باشه")
         return ConversationHandler.END
 
+    assert update.effective_user
+    assert update.effective_chat
+
     text = context.user_data["broadcast"]["text"]
 
+    now = datetime.now(tz=timezone.utc)
+    progress_message = await update.message.reply_text(
+        "ارسال شروع شد 📣", reply_markup=ReplyKeyboardRemove()
+    )
+    result = await db["broadcasts"].insert_one(
+        {
+            "text": text,
+            "created_by_user_id": update.effective_user.id,
+            "admin_chat_id": update.effective_chat.id,
+            "progress_message_id": progress_message.message_id,
+            "status": "running",
+            "checkpoint": None,
+            "counts": {"delivered": 0, "failed": 0, "blocked": 0},
+            "created_at": now,
+            "finished_at": None,
+        }
+    )
+
     context.job_queue.run_once(
-        broadcast_to_all,
+        broadcast_callback,
         when=0,
-        data={
-            "text": text,
-        },
+        data={"broadcast_id": result.inserted_id},
     )
 
     return ConversationHandler.END
 
 
-async def broadcast_to_all(context: ContextTypes.DEFAULT_TYPE):
+@leader_only
+async def resume_broadcasts(context: ContextTypes.DEFAULT_TYPE):
+    assert context.job_queue
+
+    # broadcasts still running elsewhere are skipped once their lease is checked
+    async for broadcast in db["broadcasts"].find({"status": "running"}, {"_id": 1}):
+        context.job_queue.run_once(
+            broadcast_callback, when=0, data={"broadcast_id": broadcast["_id"]}
+        )
+
+
+async def broadcast_callback(context: ContextTypes.DEFAULT_TYPE):
     assert context.job
     assert isinstance(context.job.data, dict)
 
-    text = context.job.data["text"]
+    await run_broadcast(context.job.data["broadcast_id"], context)
 
-    users = db["users"].find({})
 
-    async for user in users:
+async def broadcast_to_user(
+    broadcast: dict, user_id: int, context: ContextTypes.DEFAULT_TYPE
+) -> str:
+    try:
         await context.bot.send_message(
-            chat_id=user["user_id"],
+            chat_id=user_id,
+            text=broadcast["text"],
+            rate_limit_args=Priority.BROADCAST,
+        )
+        status = "delivered"
+    except Forbidden:
+        status = "blocked"
+    except TelegramError:
+        logger.exception(f"failed to broadcast to {user_id}")
+        status = "failed"
+
+    await db["broadcast_deliveries"].update_one(
+        {"broadcast_id": broadcast["_id"], "user_id": user_id},
+        {
+            "$setOnInsert": {
+                "status": status,
+                "sent_at": datetime.now(tz=timezone.utc),
+            }
+        },
+        upsert=True,
+    )
+
+    return status
+
+
+async def report_broadcast_progress(
+    broadcast: dict, context: ContextTypes.DEFAULT_TYPE, done: bool
+):
+    counts = broadcast["counts"]
+    text = (
+        f"{'ارسال تموم شد ✅' if done else 'در حال ارسال 📣'}\n\n"
+        f"تحویل داده شد: {counts['delivered']}\n"
+        f"بلاک کرده بودن: {counts['blocked']}\n"
+        f"خطا: {counts['failed']}"
+    )
+    try:
+        await context.bot.edit_message_text(
+            chat_id=broadcast["admin_chat_id"],
+            message_id=broadcast["progress_message_id"],
             text=text,
         )
+    except TelegramError:
+        logger.exception("failed to report broadcast progress")
+
+
+async def run_broadcast(broadcast_id: ObjectId, context: ContextTypes.DEFAULT_TYPE):
+    # whichever instance holds the lease of a broadcast sends it, another one
+    # takes over if that instance goes away
+    lease = Lease(f"broadcast:{broadcast_id}", ttl=LEASE_TTL)
+    if not await lease.acquire():
+        return
+
+    keeper = asyncio.create_task(lease.keep(LEASE_RENEW_INTERVAL))
+    try:
+        await deliver_broadcast(broadcast_id, lease, context)
+    finally:
+        keeper.cancel()
+        await asyncio.gather(keeper, return_exceptions=True)
+
+
+def fenced(broadcast_id: ObjectId, token: int) -> dict:
+    # only matches while no newer holder of the lease has written
+    return {"_id": broadcast_id, "fence": {"$not": {"$gt": token}}}
+
+
+async def deliver_broadcast(
+    broadcast_id: ObjectId, lease: Lease, context: ContextTypes.DEFAULT_TYPE
+):
+    token = lease.token
+    assert token is not None
+
+    broadcast = await db["broadcasts"].find_one({"_id": broadcast_id})
+    assert broadcast is not None
+    if broadcast["status"] != "running":
+        return
+
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send(user_id: int) -> str:
+        async with semaphore:
+            return await broadcast_to_user(broadcast, user_id, context)
+
+    last_reported_at = monotonic()
+
+    while broadcast["status"] == "running":
+        if not lease.is_held():
+            logger.warning(f"lost broadcast {broadcast_id}, stopping")
+            return
+
+        query = {}
+        if broadcast["checkpoint"] is not None:
+            query["_id"] = {"$gt": broadcast["checkpoint"]}
+        users = (
+            await db["users"]
+            .find(query, {"user_id": 1})
+            .sort("_id", 1)
+            .limit(BROADCAST_BATCH_SIZE)
+            .to_list(None)
+        )
+        if len(users) == 0:
+            break
+
+        # recipients of an interrupted batch that were already handled
+        done = set(
+            await db["broadcast_deliveries"].distinct(
+                "user_id",
+                {
+                    "broadcast_id": broadcast_id,
+                    "user_id": {"$in": [user["user_id"] for user in users]},
+                },
+            )
+        )
+        statuses = await asyncio.gather(
+            *[send(user["user_id"]) for user in users if user["user_id"] not in done]
+        )
+
+        checkpoint: dict = {"$set": {"checkpoint": users[-1]["_id"], "fence": token}}
+        if statuses:
+            checkpoint["$inc"] = {
+                f"counts.{status}": statuses.count(status) for status in set(statuses)
+            }
+        broadcast = await db["broadcasts"].find_one_and_update(
+            fenced(broadcast_id, token),
+            checkpoint,
+            return_document=ReturnDocument.AFTER,
+        )
+        if broadcast is None:
+            logger.warning(f"broadcast {broadcast_id} was taken over, stopping")
+            return
+
+        if monotonic() - last_reported_at >= BROADCAST_PROGRESS_INTERVAL:
+            await report_broadcast_progress(broadcast, context, done=False)
+            last_reported_at = monotonic()
+
+    # the incremental counts miss recipients of interrupted batches, recount
+    counts = {"delivered": 0, "failed": 0, "blocked": 0}
+    async for group in db["broadcast_deliveries"].aggregate(
+        [
+            {"$match": {"broadcast_id": broadcast_id}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]
+    ):
+        counts[group["_id"]] = group["count"]
+
+    broadcast = await db["broadcasts"].find_one_and_update(
+        fenced(broadcast_id, token),
+        {
+            "$set": {
+                "status": "done",
+                "counts": counts,
+                "finished_at": datetime.now(tz=timezone.utc),
+            }
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if broadcast is None:
+        logger.warning(f"broadcast {broadcast_id} was taken over, stopping")
+        return
+
+    await report_broadcast_progress(broadcast, context, done=True)
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items: OrderedDict[K, tuple[float | None, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _expired(self, expires_at: float | None) -> bool:
+        return expires_at is not None and monotonic() >= expires_at
+
+    def __contains__(self, key: K) -> bool:
+        return key in self.items and not self._expired(self.items[key][0])
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get(self, key: K, default: Any = None) -> V | Any:
+        if key not in self.items:
+            self.misses += 1
+            return default
+        expires_at, value = self.items[key]
+        if self._expired(expires_at):
+            del self.items[key]
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.items.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V):
+        expires_at = monotonic() + self.ttl if self.ttl is not None else None
+        self.items[key] = (expires_at, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def pop(self, key: K):
+        self.items.pop(key, None)
+
+    def clear(self):
+        self.items.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self.items), "hits": self.hits, "misses": self.misses}
@@ -48,3 +48,95 @@ RECURRING_INTERVALS = {
 
 
 FILES_BASE_DIR = os.environ.get("OBEYD_FILES_BASE_DIR", "files")
+
+CATALOG_POLL_INTERVAL = float(os.environ.get("OBEYD_CATALOG_POLL_INTERVAL", "30"))
+JOKE_STATS_POLL_INTERVAL = float(os.environ.get("OBEYD_JOKE_STATS_POLL_INTERVAL", "30"))
+
+SEEN_CACHE_SIZE = int(os.environ.get("OBEYD_SEEN_CACHE_SIZE", "10000"))
+SEEN_CACHE_TTL = float(os.environ.get("OBEYD_SEEN_CACHE_TTL", "60"))
+
+INLINE_POOL_SIZE = int(os.environ.get("OBEYD_INLINE_POOL_SIZE", "200"))
+INLINE_POOL_LOW_WATER = int(os.environ.get("OBEYD_INLINE_POOL_LOW_WATER", "50"))
+INLINE_POOL_MAX_AGE = float(os.environ.get("OBEYD_INLINE_POOL_MAX_AGE", "60"))
+INLINE_POOL_REFILL_INTERVAL = float(
+    os.environ.get("OBEYD_INLINE_POOL_REFILL_INTERVAL", "5")
+)
+
+RECURRING_DISPATCH_BATCH_SIZE = int(
+    os.environ.get("OBEYD_RECURRING_DISPATCH_BATCH_SIZE", "500")
+)
+
+SEND_GLOBAL_RATE = float(os.environ.get("OBEYD_SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.environ.get("OBEYD_SEND_CHAT_RATE", "1"))
+SEND_GROUP_RATE = float(os.environ.get("OBEYD_SEND_GROUP_RATE", str(20 / 60)))
+SEND_MAX_RETRIES = int(os.environ.get("OBEYD_SEND_MAX_RETRIES", "3"))
+
+METRICS_LOG_INTERVAL = float(os.environ.get("OBEYD_METRICS_LOG_INTERVAL", "300"))
+
+BROADCAST_CONCURRENCY = int(os.environ.get("OBEYD_BROADCAST_CONCURRENCY", "20"))
+BROADCAST_BATCH_SIZE = int(os.environ.get("OBEYD_BROADCAST_BATCH_SIZE", "500"))
+BROADCAST_PROGRESS_INTERVAL = float(
+    os.environ.get("OBEYD_BROADCAST_PROGRESS_INTERVAL", "30")
+)
+
+ACTIVITY_QUEUE_SIZE = int(os.environ.get("OBEYD_ACTIVITY_QUEUE_SIZE", "10000"))
+ACTIVITY_BATCH_SIZE = int(os.environ.get("OBEYD_ACTIVITY_BATCH_SIZE", "500"))
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get("OBEYD_ACTIVITY_FLUSH_INTERVAL", "1"))
+ACTIVITY_SAMPLE_RATE = float(os.environ.get("OBEYD_ACTIVITY_SAMPLE_RATE", "0.1"))
+
+SCORE_DIGEST_WINDOW = float(os.environ.get("OBEYD_SCORE_DIGEST_WINDOW", "300"))
+SCORE_DIGEST_FLUSH_INTERVAL = float(
+    os.environ.get("OBEYD_SCORE_DIGEST_FLUSH_INTERVAL", "60")
+)
+SCORE_DIGEST_MAX_NAMES = int(os.environ.get("OBEYD_SCORE_DIGEST_MAX_NAMES", "5"))
+
+USER_CACHE_SIZE = int(os.environ.get("OBEYD_USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("OBEYD_USER_CACHE_TTL", "60"))
+
+ADMIN_REFRESH_INTERVAL = float(os.environ.get("OBEYD_ADMIN_REFRESH_INTERVAL", "30"))
+
+# updates of one chat are still handled one at a time
+UPDATE_CONCURRENCY = int(os.environ.get("OBEYD_UPDATE_CONCURRENCY", "64"))
+
+# "polling" or "webhook", or "none" for an instance that only runs scheduled work
+INGEST_MODE = os.environ.get("OBEYD_INGEST_MODE", "polling")
+WEBHOOK_URL = os.environ.get("OBEYD_WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("OBEYD_WEBHOOK_PATH", "/telegram")
+WEBHOOK_HOST = os.environ.get("OBEYD_WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("OBEYD_WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET_TOKEN = os.environ.get("OBEYD_WEBHOOK_SECRET_TOKEN", "")
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("OBEYD_WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_MAX_BODY_SIZE = int(os.environ.get("OBEYD_WEBHOOK_MAX_BODY_SIZE", "1048576"))
+
+# a crashed leader is replaced within LEASE_TTL seconds
+LEASE_TTL = float(os.environ.get("OBEYD_LEASE_TTL", "10"))
+LEASE_RENEW_INTERVAL = float(os.environ.get("OBEYD_LEASE_RENEW_INTERVAL", "3"))
+
+# conversations and user_data changed within the last interval are lost on a crash
+PERSISTENCE_FLUSH_INTERVAL = float(
+    os.environ.get("OBEYD_PERSISTENCE_FLUSH_INTERVAL", "5")
+)
+# without change streams, how often other instances' writes are picked up
+PERSISTENCE_POLL_INTERVAL = float(
+    os.environ.get("OBEYD_PERSISTENCE_POLL_INTERVAL", "10")
+)
+
+# 0 runs joke selection on the event loop
+SELECTION_WORKERS = int(os.environ.get("OBEYD_SELECTION_WORKERS", "2"))
+# batched picks draw this many rows of (rows x jokes) samples at a time
+SELECTION_CHUNK_SIZE = int(os.environ.get("OBEYD_SELECTION_CHUNK_SIZE", "32"))
+LOOP_LAG_INTERVAL = float(os.environ.get("OBEYD_LOOP_LAG_INTERVAL", "0.5"))
+
+LEADERBOARD_REFRESH_INTERVAL = float(
+    os.environ.get("OBEYD_LEADERBOARD_REFRESH_INTERVAL", "300")
+)
+# views and scores younger than this wait for the next refresh. the window
+# only moves past writes that can no longer land, so it must outlast the
+# longest a joke_views write is allowed to take after its timestamp
+LEADERBOARD_LAG = float(os.environ.get("OBEYD_LEADERBOARD_LAG", "60"))
+VIEW_WRITE_TIMEOUT = float(os.environ.get("OBEYD_VIEW_WRITE_TIMEOUT", "10"))
+if LEADERBOARD_LAG <= VIEW_WRITE_TIMEOUT:
+    raise Exception("expected OBEYD_LEADERBOARD_LAG > OBEYD_VIEW_WRITE_TIMEOUT")
+# how many votes at the mean of all votes every joke starts with
+LEADERBOARD_PRIOR_VOTES = float(os.environ.get("OBEYD_LEADERBOARD_PRIOR_VOTES", "10"))
+LEADERBOARD_TOP_SIZE = int(os.environ.get("OBEYD_LEADERBOARD_TOP_SIZE", "10"))
@@ -1,25 +1,137 @@
 import asyncio
 import os
+from datetime import datetime
 
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel
 
 db_uri = os.environ["MONGODB_URI"]
 client = AsyncIOMotorClient(db_uri.rsplit("/", 1)[0])
 db = client[db_uri.rsplit("/", 1)[1]]
 
 
+INDEXES: dict[str, list[IndexModel]] = {
+    "users": [
+        IndexModel("user_id", name="user_id_unique", unique=True),
+        IndexModel("nickname", name="nickname_unique", unique=True, sparse=True),
+        IndexModel(
+            "is_admin",
+            name="is_admin_partial",
+            partialFilterExpression={"is_admin": True},
+        ),
+    ],
+    "jokes": [
+        IndexModel("visible", name="visible"),
+        IndexModel("seq", name="seq_unique", unique=True, sparse=True),
+    ],
+    "joke_views": [
+        IndexModel(
+            [("user_id", ASCENDING), ("joke_id", ASCENDING)],
+            name="user_id_joke_id_unique",
+            unique=True,
+        ),
+        IndexModel("joke_id", name="joke_id"),
+        # keyset pagination in the admin, unfiltered and by each filter
+        IndexModel([("viewed_at", ASCENDING), ("_id", ASCENDING)], name="viewed_at_id"),
+        IndexModel(
+            [("user_id", ASCENDING), ("viewed_at", ASCENDING), ("_id", ASCENDING)],
+            name="user_id_viewed_at_id",
+        ),
+        IndexModel(
+            [("joke_id", ASCENDING), ("viewed_at", ASCENDING), ("_id", ASCENDING)],
+            name="joke_id_viewed_at_id",
+        ),
+        # only scored views, the leaderboard reads those scored since its last run
+        IndexModel(
+            "scored_at",
+            name="scored_at_partial",
+            partialFilterExpression={"scored_at": {"$gt": datetime(1970, 1, 1)}},
+        ),
+    ],
+    "joke_leaderboard": [
+        IndexModel("joke_id", name="joke_id_unique", unique=True),
+        IndexModel("bayesian_score", name="bayesian_score"),
+    ],
+    # also serves lookups by chat_id alone
+    "joke_views_chat": [
+        IndexModel(
+            [("chat_id", ASCENDING), ("joke_id", ASCENDING)], name="chat_id_joke_id"
+        ),
+    ],
+    "scores": [
+        IndexModel(
+            [("user_id", ASCENDING), ("joke_id", ASCENDING)],
+            name="user_id_joke_id_unique",
+            unique=True,
+        ),
+    ],
+    "joke_stats": [
+        IndexModel("joke_id", name="joke_id_unique", unique=True),
+    ],
+    "user_score_stats": [
+        IndexModel("user_id", name="user_id_unique", unique=True),
+    ],
+    "seen_jokes": [
+        IndexModel(
+            [("kind", ASCENDING), ("owner_id", ASCENDING)],
+            name="kind_owner_id_unique",
+            unique=True,
+        ),
+    ],
+    "recurrings": [
+        IndexModel("chat_id", name="chat_id_unique", unique=True),
+        IndexModel("interval", name="interval"),
+    ],
+    "activities": [
+        IndexModel(
+            [("created_at", ASCENDING), ("_id", ASCENDING)], name="created_at_id"
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="user_id_created_at_id",
+        ),
+    ],
+    "activity_rollups": [
+        IndexModel(
+            [
+                ("granularity", ASCENDING),
+                ("bucket", ASCENDING),
+                ("kind", ASCENDING),
+                ("chat_type", ASCENDING),
+            ],
+            name="granularity_bucket_kind_chat_type_unique",
+            unique=True,
+        ),
+    ],
+    "score_digests": [
+        IndexModel("creator_id", name="creator_id_unique", unique=True),
+        IndexModel("first_scored_at", name="first_scored_at"),
+    ],
+    "broadcasts": [
+        IndexModel("status", name="status"),
+    ],
+    "persistence_conversations": [
+        IndexModel("name", name="name"),
+    ],
+    "broadcast_deliveries": [
+        IndexModel(
+            [("broadcast_id", ASCENDING), ("user_id", ASCENDING)],
+            name="broadcast_id_user_id_unique",
+            unique=True,
+        ),
+    ],
+}
+
+
+def is_scratch_db() -> bool:
+    # tools that seed or drop collections only run against these
+    return "bench" in db.name or "test" in db.name
+
+
 async def create_indexes():
-    await db["users"].create_index("user_id", name="user_id_unique", unique=True)
-    await db["users"].create_index(
-        "nickname", name="nickname_unique", unique=True, sparse=True
-    )
-    await db["joke_views"].create_index(
-        ["user_id", "joke_id"], name="user_id_joke_id_unique", unique=True
-    )
-    await db["scores"].create_index(
-        ["user_id", "joke_id"], name="user_id_joke_id_unique", unique=True
-    )
-    await db["recurrings"].create_index("chat_id", name="chat_id_unique", unique=True)
+    # creating an index that already exists with the same options is a no-op
+    for collection, indexes in INDEXES.items():
+        await db[collection].create_indexes(indexes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+import asyncio
+import sys
+from datetime import datetime, timezone
+from typing import Any
+
+from bson import ObjectId
+
+from obeyd.db import create_indexes, db, is_scratch_db
+
+now = datetime.now(tz=timezone.utc)
+epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+joke_id = ObjectId()
+broadcast_id = ObjectId()
+
+# one document per collection, enough for the planner to have something
+# to choose between
+SEED: dict[str, dict[str, Any]] = {
+    "users": {"user_id": 1, "nickname": "seed", "is_admin": True, "joined_at": now},
+    "jokes": {"_id": joke_id, "visible": True, "seq": 0, "creator_id": 1},
+    "joke_views": {
+        "user_id": 1,
+        "joke_id": joke_id,
+        "score": 4,
+        "imputed_score": 3.0,
+        "viewed_at": now,
+        "scored_at": now,
+    },
+    "joke_leaderboard": {"joke_id": joke_id, "votes": 1, "bayesian_score": 3.1},
+    "joke_views_chat": {"chat_id": 1, "joke_id": joke_id, "viewed_at": now},
+    "joke_stats": {"joke_id": joke_id, "count": 1, "sum": 3.0, "sum_sq": 9.0},
+    "user_score_stats": {"user_id": 1, "count": 1, "sum": 3},
+    "seen_jokes": {"kind": "user", "owner_id": 1, "words": {"0": 1}},
+    "recurrings": {"chat_id": 1, "chat_type": "private", "interval": "daily"},
+    "activities": {"kind": "joke", "user_id": 1, "created_at": now},
+    "activity_rollups": {
+        "kind": "joke",
+        "chat_type": "private",
+        "granularity": "hour",
+        "bucket": now,
+        "count": 1,
+    },
+    "score_digests": {"creator_id": 1, "count": 1, "first_scored_at": now},
+    "broadcasts": {"_id": broadcast_id, "status": "running"},
+    "persistence_conversations": {
+        "_id": "newjoke:1:1",
+        "name": "newjoke",
+        "key": [1, 1],
+        "state": 1,
+        "instance": "seed",
+    },
+    "broadcast_deliveries": {"broadcast_id": broadcast_id, "user_id": 1},
+}
+
+# (collection, filter, sort) of every query the bot issues outside of
+# maintenance commands, updates are explained through their filter
+QUERY_SHAPES: list[tuple[str, dict[str, Any], list[tuple[str, int]] | None]] = [
+    ("users", {"user_id": 1}, None),
+    ("users", {"is_admin": True}, None),
+    ("users", {"user_id": {"$in": [1, 2]}, "nickname": {"$ne": None}}, None),
+    ("users", {"_id": {"$gt": ObjectId()}}, [("_id", 1)]),
+    ("jokes", {"visible": True}, None),
+    ("jokes", {"_id": joke_id}, None),
+    ("jokes", {"_id": joke_id, "seq": {"$exists": False}}, None),
+    ("joke_views", {"user_id": 1, "joke_id": joke_id}, None),
+    ("joke_views", {"user_id": 1, "joke_id": joke_id, "score": None}, None),
+    ("joke_views", {"joke_id": joke_id}, None),
+    ("joke_views_chat", {"chat_id": 1, "joke_id": joke_id}, None),
+    ("joke_views_chat", {"chat_id": 1}, None),
+    ("user_score_stats", {"user_id": 1}, None),
+    ("seen_jokes", {"kind": "user", "owner_id": 1}, None),
+    ("seen_jokes", {"kind": "chat", "owner_id": {"$in": [1, 2]}}, None),
+    ("recurrings", {"chat_id": 1}, None),
+    ("recurrings", {"interval": "daily"}, None),
+    # keyset pages of the admin views
+    ("joke_views", {}, [("viewed_at", -1), ("_id", -1)]),
+    (
+        "joke_views",
+        {
+            "$or": [
+                {"viewed_at": {"$lt": now}},
+                {"viewed_at": now, "_id": {"$lt": joke_id}},
+            ]
+        },
+        [("viewed_at", -1), ("_id", -1)],
+    ),
+    ("joke_views", {"user_id": 1}, [("viewed_at", -1), ("_id", -1)]),
+    ("joke_views", {"joke_id": joke_id}, [("viewed_at", -1), ("_id", -1)]),
+    (
+        "joke_views",
+        {
+            "$and": [
+                {"user_id": 1},
+                {
+                    "$or": [
+                        {"viewed_at": {"$lt": now}},
+                        {"viewed_at": now, "_id": {"$lt": joke_id}},
+                    ]
+                },
+            ]
+        },
+        [("viewed_at", -1), ("_id", -1)],
+    ),
+    ("activities", {}, [("created_at", -1), ("_id", -1)]),
+    ("activities", {"user_id": 1}, [("created_at", -1), ("_id", -1)]),
+    (
+        "joke_views",
+        {
+            "$or": [
+                {"viewed_at": {"$gt": epoch, "$lte": now}},
+                {"scored_at": {"$gt": epoch, "$lte": now}},
+            ]
+        },
+        None,
+    ),
+    ("joke_leaderboard", {"votes": {"$gt": 0}}, [("bayesian_score", -1)]),
+    ("watermarks", {"_id": "joke_leaderboard"}, None),
+    (
+        "activity_rollups",
+        {"granularity": "hour", "bucket": now, "kind": "joke", "chat_type": None},
+        None,
+    ),
+    ("score_digests", {"creator_id": 1}, None),
+    ("score_digests", {"first_scored_at": {"$lte": now}}, None),
+    ("broadcasts", {"status": "running"}, None),
+    ("broadcasts", {"_id": broadcast_id}, None),
+    (
+        "broadcast_deliveries",
+        {"broadcast_id": broadcast_id, "user_id": {"$in": [1, 2]}},
+        None,
+    ),
+    ("broadcast_deliveries", {"broadcast_id": broadcast_id}, None),
+    ("counters", {"_id": "joke_seq"}, None),
+    ("persistence_conversations", {"name": "newjoke", "state": {"$ne": None}}, None),
+]
+
+
+def plan_stages(plan: Any) -> list[str]:
+    if isinstance(plan, dict):
+        stages = [plan["stage"]] if "stage" in plan else []
+        return stages + [s for value in plan.values() for s in plan_stages(value)]
+    if isinstance(plan, list):
+        return [s for value in plan for s in plan_stages(value)]
+    return []
+
+
+async def seed():
+    for collection, doc in SEED.items():
+        await db[collection].drop()
+        await db[collection].insert_one(doc)
+    await db["counters"].drop()
+    await db["counters"].insert_one({"_id": "joke_seq", "value": 1})
+    await create_indexes()
+
+
+async def check_query_plans() -> list[str]:
+    failures = []
+    for collection, filter, sort in QUERY_SHAPES:
+        cursor = db[collection].find(filter)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+        # an in-memory SORT reads every match before returning the first row
+        for stage in ["COLLSCAN", "SORT"]:
+            if stage in stages:
+                failures.append(f"{stage}: {collection} {filter} sort={sort}: {stages}")
+    return failures
+
+
+async def main():
+    if not is_scratch_db():
+        raise Exception("expected MONGODB_URI to point at a *bench* or *test* database")
+
+    await seed()
+    failures = await check_query_plans()
+    for failure in failures:
+        print(failure)
+    print(f"{len(failures)} problems in {len(QUERY_SHAPES)} query shapes")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -9,6 +9,20 @@ async def main():
     await db["joke_views_chat"].delete_many({})
     await db["recurrings"].delete_many({})
     await db["activities"].delete_many({})
+    await db["activity_rollups"].delete_many({})
+    await db["joke_stats"].delete_many({})
+    await db["user_score_stats"].delete_many({})
+    await db["seen_jokes"].delete_many({})
+    await db["counters"].delete_many({})
+    await db["broadcasts"].delete_many({})
+    await db["score_digests"].delete_many({})
+    await db["broadcast_deliveries"].delete_many({})
+    await db["leases"].delete_many({})
+    await db["fences"].delete_many({})
+    await db["persistence_user_data"].delete_many({})
+    await db["persistence_conversations"].delete_many({})
+    await db["joke_leaderboard"].delete_many({})
+    await db["watermarks"].delete_many({})
 
 
 if __name__ == "__main__":
@@ -7,6 +7,8 @@ from telegram.ext import ContextTypes, ConversationHandler
 from obeyd.config import REVIEW_JOKES_CHAT_ID
 from obeyd.db import db
 from obeyd.middlewares import authenticated, log_activity
+from obeyd.sender import Priority
+from obeyd.user_cache import get_user
 
 FEEDBACK_STATES_FEEDBACK = 1
 
@@ -57,7 +59,7 @@ async def feedback_notify_admin(context: ContextTypes.DEFAULT_TYPE):
 
     feedback = context.job.data
 
-    user = await db["users"].find_one({"user_id": feedback["user_id"]})
+    user = await get_user(feedback["user_id"])
 
     if user is not None:
         text = f"فیدبک جدیدی از طرف <b>{user['user_fullname']}</b> دریافت شد:\n\n{feedback['feedback']}"
@@ -67,4 +69,5 @@ async def feedback_notify_admin(context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(
         chat_id=REVIEW_JOKES_CHAT_ID,
         text=text,
+        rate_limit_args=Priority.NOTIFICATION,
     )
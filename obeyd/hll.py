@@ -0,0 +1,29 @@
+import hashlib
+import math
+from typing import Any
+
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+
+def hll_register(value: Any) -> tuple[int, int]:
+    h = int.from_bytes(
+        hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big"
+    )
+    index = h >> (64 - HLL_PRECISION)
+    rest = h & ((1 << (64 - HLL_PRECISION)) - 1)
+    rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+    return index, rank
+
+
+def hll_estimate(registers: dict[str, int]) -> float:
+    # registers are stored sparsely as {"<index>": rank}, missing ones are 0
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    zeros = m - len(registers)
+    harmonic = zeros + sum(2.0**-rank for rank in registers.values())
+    estimate = alpha * m * m / harmonic
+
+    if estimate <= 2.5 * m and zeros > 0:
+        return m * math.log(m / zeros)
+    return estimate
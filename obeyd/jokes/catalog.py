@@ -0,0 +1,89 @@
+from typing import Any
+
+import numpy as np
+from bson import ObjectId
+
+from obeyd.config import CATALOG_POLL_INTERVAL
+from obeyd.db import db
+from obeyd.jokes.seen import ensure_joke_seq
+from obeyd.watch import watch_collection
+
+
+class JokeCatalog:
+    def __init__(self):
+        self.jokes: dict[ObjectId, dict] = {}
+        self._visible_jokes: list[dict] | None = None
+        self._visible_seqs: np.ndarray | None = None
+
+    def get(self, joke_id: ObjectId) -> dict | None:
+        return self.jokes.get(joke_id)
+
+    def visible_jokes(self) -> list[dict]:
+        if self._visible_jokes is None:
+            self._visible_jokes = list(self.jokes.values())
+        return self._visible_jokes
+
+    def visible_seqs(self) -> np.ndarray:
+        # dense joke indexes aligned with visible_jokes(), -1 where missing
+        if self._visible_seqs is None:
+            self._visible_seqs = np.array(
+                [joke.get("seq", -1) for joke in self.visible_jokes()],
+                dtype=np.int64,
+            )
+        return self._visible_seqs
+
+    def put(self, joke: dict):
+        if joke.get("visible"):
+            self.jokes[joke["_id"]] = joke
+        else:
+            self.jokes.pop(joke["_id"], None)
+        self._invalidate()
+
+    def remove(self, joke_id: ObjectId):
+        self.jokes.pop(joke_id, None)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._visible_jokes = None
+        self._visible_seqs = None
+
+    async def reload(self):
+        jokes = await db["jokes"].find({"visible": True}).to_list(None)
+        for joke in jokes:
+            await ensure_joke_seq(joke)
+        self.jokes = {joke["_id"]: joke for joke in jokes}
+        self._invalidate()
+
+    async def on_change(self, change: dict[str, Any]):
+        if change["operationType"] in ["insert", "update", "replace"]:
+            joke = change.get("fullDocument")
+            if joke is None:
+                # the joke was deleted before the update could be looked up
+                self.remove(change["documentKey"]["_id"])
+            else:
+                if joke.get("visible"):
+                    await ensure_joke_seq(joke)
+                self.put(joke)
+        elif change["operationType"] == "delete":
+            self.remove(change["documentKey"]["_id"])
+        elif change["operationType"] in ["drop", "rename", "invalidate"]:
+            await self.reload()
+
+
+catalog = JokeCatalog()
+
+
+async def find_joke(joke_id: ObjectId) -> dict | None:
+    joke = catalog.get(joke_id)
+    if joke is None:
+        joke = await db["jokes"].find_one({"_id": joke_id})
+    return joke
+
+
+async def watch_catalog():
+    await watch_collection(
+        db["jokes"],
+        on_change=catalog.on_change,
+        on_resync=catalog.reload,
+        poll_interval=CATALOG_POLL_INTERVAL,
+    )
@@ -0,0 +1,145 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from telegram.error import NetworkError, RetryAfter, TelegramError
+from telegram.ext import ContextTypes
+
+from obeyd.config import SCORE_DIGEST_MAX_NAMES, SCORE_DIGEST_WINDOW, SCORES
+from obeyd.db import db
+from obeyd.jokes.catalog import find_joke
+from obeyd.jokes.functions import format_text_joke
+from obeyd.lease import leader_only
+from obeyd.sender import Priority
+
+logger = logging.getLogger(__name__)
+
+
+async def buffer_score_event(joke_id: ObjectId, user_id: int, score: int):
+    joke = await find_joke(joke_id)
+    if joke is None:
+        # deleted between the view and the score
+        logger.warning(f"scored joke {joke_id} no longer exists")
+        return
+
+    await db["score_digests"].update_one(
+        {"creator_id": joke["creator_id"]},
+        {
+            "$inc": {"count": 1, f"scores.{score}": 1},
+            "$addToSet": {"joke_ids": joke_id},
+            "$push": {
+                "scored_by": {
+                    "$each": [{"user_id": user_id, "score": score}],
+                    "$slice": -SCORE_DIGEST_MAX_NAMES,
+                }
+            },
+            "$setOnInsert": {"first_scored_at": datetime.now(tz=timezone.utc)},
+        },
+        upsert=True,
+    )
+
+
+def format_score_digest(digest: dict, nicknames: dict[int, str], joke: dict | None):
+    if digest["count"] == 1:
+        scored_by = digest["scored_by"][-1]
+        msg = SCORES[scored_by["score"]]["score_notif"].format(
+            s=nicknames.get(scored_by["user_id"], "ناشناسی")
+        )
+    else:
+        scores = " ".join(
+            f"{SCORES[score]['emoji']}×{digest['scores'][str(score)]}"
+            for score in sorted(SCORES, reverse=True)
+            if str(score) in digest["scores"]
+        )
+        jokes = "جوکت" if len(digest["joke_ids"]) == 1 else "جوک‌هات"
+        msg = f"<b>{digest['count']}</b> نفر به {jokes} رای دادن: {scores}"
+
+        names = [
+            f"<b>{nicknames[s['user_id']]}</b>"
+            for s in digest["scored_by"]
+            if s["user_id"] in nicknames
+        ]
+        if names:
+            msg += f"\n\n{'، '.join(dict.fromkeys(names))}"
+            if digest["count"] > len(names):
+                msg += " و ..."
+
+    if joke is not None and joke["kind"] == "text":
+        msg += f"\n\n{format_text_joke(joke)}"
+
+    return msg
+
+
+async def restore_score_digest(digest: dict):
+    # puts back a digest that could not be sent, merged with any scores that
+    # started the creator's next one, so it is due again on the next flush
+    await db["score_digests"].update_one(
+        {"creator_id": digest["creator_id"]},
+        {
+            "$inc": {
+                "count": digest["count"],
+                **{f"scores.{score}": n for score, n in digest["scores"].items()},
+            },
+            "$addToSet": {"joke_ids": {"$each": digest["joke_ids"]}},
+            "$push": {
+                "scored_by": {
+                    "$each": digest["scored_by"],
+                    "$position": 0,
+                    "$slice": -SCORE_DIGEST_MAX_NAMES,
+                }
+            },
+            "$min": {"first_scored_at": digest["first_scored_at"]},
+        },
+        upsert=True,
+    )
+
+
+@leader_only
+async def flush_score_digests(context: ContextTypes.DEFAULT_TYPE):
+    due = datetime.now(tz=timezone.utc) - timedelta(seconds=SCORE_DIGEST_WINDOW)
+
+    # claim each due digest by deleting it, scores that arrive meanwhile
+    # start the next digest of the creator
+    digests = []
+    async for digest in db["score_digests"].find(
+        {"first_scored_at": {"$lte": due}}, {"_id": 1}
+    ):
+        claimed = await db["score_digests"].find_one_and_delete({"_id": digest["_id"]})
+        if claimed is not None:
+            digests.append(claimed)
+
+    if not digests:
+        return
+
+    user_ids = {s["user_id"] for digest in digests for s in digest["scored_by"]}
+    nicknames = {
+        user["user_id"]: user["nickname"]
+        async for user in db["users"].find(
+            {"user_id": {"$in": list(user_ids)}, "nickname": {"$ne": None}},
+            {"user_id": 1, "nickname": 1},
+        )
+    }
+
+    for digest in digests:
+        joke = None
+        if len(digest["joke_ids"]) == 1:
+            joke = await find_joke(digest["joke_ids"][0])
+
+        try:
+            await context.bot.send_message(
+                chat_id=digest["creator_id"],
+                text=format_score_digest(digest, nicknames, joke),
+                rate_limit_args=Priority.NOTIFICATION,
+            )
+        except (NetworkError, RetryAfter):
+            # worth another try, unlike e.g. a creator who blocked the bot
+            logger.exception(f"failed to send score digest to {digest['creator_id']}")
+            try:
+                await restore_score_digest(digest)
+            except PyMongoError:
+                logger.exception(
+                    f"failed to restore score digest of {digest['creator_id']}"
+                )
+        except TelegramError:
+            logger.exception(f"failed to send score digest to {digest['creator_id']}")
@@ -0,0 +1,58 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Any, Callable, TypeVar
+
+from obeyd.config import SELECTION_WORKERS
+
+T = TypeVar("T")
+
+
+class SelectionExecutor:
+    # numpy releases the gil for the heavy array work, so a few threads are
+    # enough to keep sampling off the event loop
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.pool = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="selection")
+            if workers > 0
+            else None
+        )
+
+        self.calls = 0
+        # time spent in offloaded calls, that the loop would have been blocked
+        self.offloaded = 0.0
+        self.max_offloaded = 0.0
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "calls": self.calls,
+            "offloaded_ms": round(self.offloaded * 1000, 2),
+            "max_offloaded_ms": round(self.max_offloaded * 1000, 2),
+        }
+
+    async def run(self, f: Callable[..., T], *args) -> T:
+        if self.pool is None:
+            return f(*args)
+
+        def timed() -> tuple[T, float]:
+            start = perf_counter()
+            result = f(*args)
+            return result, perf_counter() - start
+
+        result, elapsed = await asyncio.get_running_loop().run_in_executor(
+            self.pool, timed
+        )
+        self.calls += 1
+        self.offloaded += elapsed
+        self.max_offloaded = max(self.max_offloaded, elapsed)
+        return result
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+selection_executor = SelectionExecutor(SELECTION_WORKERS)
@@ -1,21 +1,67 @@
+import asyncio
+import logging
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Awaitable, Callable
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import pymongo
+from pymongo.errors import DuplicateKeyError
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
-from obeyd.config import FILES_BASE_DIR, SCORES
+from obeyd.config import FILES_BASE_DIR, SCORES, VIEW_WRITE_TIMEOUT
 from obeyd.db import db
-from obeyd.jokes.thompson import thompson_sampled_joke
+from obeyd.jokes.seen import SeenKind, get_seen_set, get_seen_sets, mark_seen
+from obeyd.jokes.stats import record_view_stats, user_average_score
+from obeyd.jokes.thompson import thompson_sampled_joke, thompson_sampled_jokes_for
+
+logger = logging.getLogger(__name__)
 
 
 def format_text_joke(joke: dict):
     return f"{joke['text']}\n\n<b>{joke['creator_nickname']}</b>"
 
 
-async def send_joke(
+def telegram_file_id_of(message: Message) -> str | None:
+    if message.voice is not None:
+        return message.voice.file_id
+    if message.video_note is not None:
+        return message.video_note.file_id
+    if len(message.photo) > 0:
+        return message.photo[-1].file_id
+    return None
+
+
+async def send_joke_media(
+    joke: dict, send: Callable[..., Awaitable[Message]], **kwargs
+) -> Message:
+    # the media argument is named after the joke kind, e.g. voice=...
+    telegram_file_id = joke.get("telegram_file_id")
+    if telegram_file_id is not None:
+        try:
+            return await send(**{joke["kind"]: telegram_file_id}, **kwargs)
+        except BadRequest:
+            logger.warning(
+                f"telegram rejected the file id of joke {joke['_id']}, uploading it"
+            )
+
+    message = await send(
+        **{joke["kind"]: Path(f"{FILES_BASE_DIR}/{joke['file_id']}.bin")}, **kwargs
+    )
+
+    telegram_file_id = telegram_file_id_of(message)
+    if telegram_file_id is not None:
+        joke["telegram_file_id"] = telegram_file_id
+        await db["jokes"].update_one(
+            {"_id": joke["_id"]}, {"$set": {"telegram_file_id": telegram_file_id}}
+        )
+
+    return message
+
+
+async def deliver_joke(
     joke: dict,
-    user_id: str | int | None,
     chat_id: str | int,
     context: ContextTypes.DEFAULT_TYPE,
     kwargs: dict,
@@ -27,22 +73,25 @@ async def send_joke(
             **kwargs,
         )
     elif joke["kind"] == "voice":
-        await context.bot.send_voice(
+        await send_joke_media(
+            joke,
+            context.bot.send_voice,
             chat_id=chat_id,
-            voice=Path(f"{FILES_BASE_DIR}/{joke['file_id']}.bin"),
             caption=format_text_joke(joke),
             **kwargs,
         )
     elif joke["kind"] == "video_note":
-        await context.bot.send_video_note(
+        await send_joke_media(
+            joke,
+            context.bot.send_video_note,
             chat_id=chat_id,
-            video_note=Path(f"{FILES_BASE_DIR}/{joke['file_id']}.bin"),
             **kwargs,
         )
     elif joke["kind"] == "photo":
-        await context.bot.send_photo(
+        await send_joke_media(
+            joke,
+            context.bot.send_photo,
             chat_id=chat_id,
-            photo=Path(f"{FILES_BASE_DIR}/{joke['file_id']}.bin"),
             caption=format_text_joke(joke),
             **kwargs,
         )
@@ -51,26 +100,83 @@ async def send_joke(
             "expected 'kind' to be one of 'text' or 'voice' or 'video_note' or 'photo'"
         )
 
-    if user_id is not None:
-        await db["joke_views"].insert_one(
-            {
-                "user_id": user_id,
-                "joke_id": joke["_id"],
-                "score": None,
-                "viewed_at": datetime.now(tz=timezone.utc),
-                "scored_at": None,
-            }
-        )
 
-    await db["joke_views_chat"].insert_one(
-        {
-            "chat_id": chat_id,
-            "joke_id": joke["_id"],
-            "viewed_at": datetime.now(tz=timezone.utc),
-        }
+async def send_joke(
+    joke: dict,
+    user_id: str | int | None,
+    chat_id: str | int,
+    context: ContextTypes.DEFAULT_TYPE,
+    kwargs: dict,
+):
+    async def average_score() -> float | None:
+        if user_id is None:
+            return None
+        return await user_average_score(int(user_id))
+
+    # the viewer's average is read while telegram delivers the joke
+    imputed_score, _ = await asyncio.gather(
+        average_score(), deliver_joke(joke, chat_id, context, kwargs)
+    )
+
+    await record_joke_view(joke, user_id, chat_id, imputed_score)
+
+
+async def insert_user_view(
+    joke: dict, user_id: int, imputed_score: float | None
+) -> bool:
+    # the leaderboard counts views by viewed_at, a write landing later than
+    # its lag behind it would be missed
+    try:
+        with pymongo.timeout(VIEW_WRITE_TIMEOUT):
+            result = await db["joke_views"].update_one(
+                {"user_id": user_id, "joke_id": joke["_id"]},
+                {
+                    "$setOnInsert": {
+                        "score": None,
+                        "imputed_score": imputed_score,
+                        "viewed_at": datetime.now(tz=timezone.utc),
+                        "scored_at": None,
+                    }
+                },
+                upsert=True,
+            )
+    except DuplicateKeyError:
+        # a concurrent view of the same joke won the upsert
+        return False
+    return result.upserted_id is not None
+
+
+async def record_user_view(joke: dict, user_id: int, imputed_score: float | None):
+    # a repeated view is not a new observation
+    if await insert_user_view(joke, user_id, imputed_score):
+        await record_view_stats(joke["_id"], imputed_score)
+
+
+async def record_chat_view(joke: dict, chat_id: str | int):
+    await db["joke_views_chat"].update_one(
+        {"chat_id": chat_id, "joke_id": joke["_id"]},
+        {"$setOnInsert": {"viewed_at": datetime.now(tz=timezone.utc)}},
+        upsert=True,
     )
 
 
+async def record_joke_view(
+    joke: dict,
+    user_id: str | int | None,
+    chat_id: str | int,
+    imputed_score: float | None,
+):
+    writes = [record_chat_view(joke, chat_id)]
+    if joke.get("seq") is not None:
+        writes.append(mark_seen("chat", int(chat_id), joke["seq"]))
+    if user_id is not None:
+        writes.append(record_user_view(joke, int(user_id), imputed_score))
+        if joke.get("seq") is not None:
+            writes.append(mark_seen("user", int(user_id), joke["seq"]))
+
+    await asyncio.gather(*writes)
+
+
 def scorejoke_inline_keyboard_markup(joke: dict):
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -85,13 +191,9 @@ def scorejoke_inline_keyboard_markup(joke: dict):
     )
 
 
-async def select_joke_for(
-    chat_type: str | None = None,
-    chat_id: str | int | None = None,
-    user_id: int | None = None,
-) -> dict | None:
-    exclude_jokes = []
-
+def seen_set_key_for(
+    chat_type: str | None, chat_id: str | int | None, user_id: int | None
+) -> tuple[SeenKind, int]:
     if (chat_type is None and chat_id is not None) or (
         chat_type is not None and chat_id is None
     ):
@@ -101,16 +203,35 @@ async def select_joke_for(
 
     if chat_type == "private":
         assert user_id is not None
-        views = await db["joke_views"].find({"user_id": user_id}).to_list(None)
-        exclude_jokes += [view["joke_id"] for view in views]
+        return ("user", user_id)
     elif chat_type in ["group", "supergroup"]:
         assert user_id is not None
         assert chat_id is not None
-        views = await db["joke_views_chat"].find({"chat_id": chat_id}).to_list(None)
-        exclude_jokes += [view["joke_id"] for view in views]
+        return ("chat", int(chat_id))
     else:
         raise Exception(
             "expected 'chat_type' to be one of 'private', 'group','supergroup'"
         )
 
+
+async def select_joke_for(
+    chat_type: str | None = None,
+    chat_id: str | int | None = None,
+    user_id: int | None = None,
+) -> dict | None:
+    exclude_jokes = await get_seen_set(*seen_set_key_for(chat_type, chat_id, user_id))
+
     return await thompson_sampled_joke(exclude_jokes=exclude_jokes)
+
+
+async def select_jokes_for(
+    requesters: list[tuple[str | None, str | int | None, int | None]],
+) -> list[dict | None]:
+    exclude_jokes = await get_seen_sets(
+        [
+            seen_set_key_for(chat_type, chat_id, user_id)
+            for chat_type, chat_id, user_id in requesters
+        ]
+    )
+
+    return await thompson_sampled_jokes_for(exclude_jokes)
@@ -5,6 +5,7 @@ from obeyd.jokes.functions import (
     format_text_joke,
     scorejoke_inline_keyboard_markup,
 )
+from obeyd.jokes.pool import inline_pool
 from obeyd.jokes.thompson import thompson_sampled_joke
 from obeyd.middlewares import log_activity
 
@@ -13,7 +14,9 @@ from obeyd.middlewares import log_activity
 async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assert update.inline_query
 
-    joke = await thompson_sampled_joke()
+    joke = inline_pool.pop()
+    if joke is None:
+        joke = await thompson_sampled_joke()
     assert joke is not None
 
     await update.inline_query.answer(
@@ -0,0 +1,259 @@
+import asyncio
+import html
+import sys
+from datetime import datetime, timedelta, timezone
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from obeyd.config import (
+    LEADERBOARD_LAG,
+    LEADERBOARD_PRIOR_VOTES,
+    LEADERBOARD_TOP_SIZE,
+    SCORES,
+)
+from obeyd.db import create_indexes, db
+from obeyd.jokes.catalog import catalog
+from obeyd.lease import leader_only
+from obeyd.middlewares import log_activity
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _window_pipeline(since: datetime, until: datetime) -> list[dict]:
+    # per-joke deltas of the views made and the scores given in the window,
+    # a view made before it and scored within it only adds a vote
+    viewed = {"$and": [{"$gt": ["$viewed_at", since]}, {"$lte": ["$viewed_at", until]}]}
+    scored = {
+        "$and": [
+            {"$ne": [{"$ifNull": ["$score", None]}, None]},
+            {"$gt": ["$scored_at", since]},
+            {"$lte": ["$scored_at", until]},
+        ]
+    }
+    return [
+        {
+            "$match": {
+                "$or": [
+                    {"viewed_at": {"$gt": since, "$lte": until}},
+                    {"scored_at": {"$gt": since, "$lte": until}},
+                ]
+            }
+        },
+        {
+            "$project": {
+                "joke_id": 1,
+                "score": 1,
+                "new_view": {"$cond": [viewed, 1, 0]},
+                "new_vote": {"$cond": [scored, 1, 0]},
+            }
+        },
+        {
+            "$group": {
+                "_id": "$joke_id",
+                "views": {"$sum": "$new_view"},
+                "votes": {"$sum": "$new_vote"},
+                "score_sum": {"$sum": {"$multiply": ["$new_vote", "$score"]}},
+                **{
+                    f"score_{score}": {
+                        "$sum": {
+                            "$cond": [
+                                {"$eq": ["$score", score]},
+                                "$new_vote",
+                                0,
+                            ]
+                        }
+                    }
+                    for score in SCORES
+                },
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "joke_id": "$_id",
+                "views": 1,
+                "votes": 1,
+                "score_sum": 1,
+                "histogram": {str(score): f"$score_{score}" for score in SCORES},
+                "window": until,
+            }
+        },
+    ]
+
+
+def _merge_stage() -> dict:
+    # a window merged twice (a run that died before moving the watermark)
+    # is only counted once
+    applied = {"$eq": ["$window", "$$new.window"]}
+
+    def added(field: str) -> dict:
+        return {
+            "$cond": [applied, f"${field}", {"$add": [f"${field}", f"$$new.{field}"]}]
+        }
+
+    return {
+        "$merge": {
+            "into": "joke_leaderboard",
+            "on": "joke_id",
+            "whenMatched": [
+                {
+                    "$set": {
+                        "views": added("views"),
+                        "votes": added("votes"),
+                        "score_sum": added("score_sum"),
+                        "histogram": {
+                            str(score): added(f"histogram.{score}") for score in SCORES
+                        },
+                        "window": "$$new.window",
+                    }
+                }
+            ],
+            "whenNotMatched": "insert",
+        }
+    }
+
+
+async def update_rankings():
+    totals = (
+        await db["joke_leaderboard"]
+        .aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": None,
+                        "votes": {"$sum": "$votes"},
+                        "score_sum": {"$sum": "$score_sum"},
+                    }
+                }
+            ]
+        )
+        .to_list(None)
+    )
+    votes = totals[0]["votes"] if totals else 0
+    prior_mean = totals[0]["score_sum"] / votes if votes else 3.0
+
+    # jokes with few votes are pulled towards the mean of all votes
+    await db["joke_leaderboard"].update_many(
+        {},
+        [
+            {
+                "$set": {
+                    "mean": {
+                        "$cond": [
+                            {"$gt": ["$votes", 0]},
+                            {"$divide": ["$score_sum", "$votes"]},
+                            None,
+                        ]
+                    },
+                    "bayesian_score": {
+                        "$divide": [
+                            {
+                                "$add": [
+                                    LEADERBOARD_PRIOR_VOTES * prior_mean,
+                                    "$score_sum",
+                                ]
+                            },
+                            {"$add": [LEADERBOARD_PRIOR_VOTES, "$votes"]},
+                        ]
+                    },
+                }
+            }
+        ],
+    )
+
+
+async def refresh_leaderboard():
+    watermark = await db["watermarks"].find_one({"_id": "joke_leaderboard"})
+    since = watermark["at"] if watermark is not None else EPOCH
+
+    # a window is fixed before it is merged, so that a run that dies halfway
+    # is retried with the same window. it ends LEADERBOARD_LAG in the past,
+    # longer than a joke_views write may take to land after its timestamp
+    until = watermark.get("pending") if watermark is not None else None
+    if until is None:
+        until = datetime.now(tz=timezone.utc) - timedelta(seconds=LEADERBOARD_LAG)
+        await db["watermarks"].update_one(
+            {"_id": "joke_leaderboard"},
+            {"$set": {"at": since, "pending": until}},
+            upsert=True,
+        )
+
+    await db["joke_views"].aggregate(
+        _window_pipeline(since, until) + [_merge_stage()]
+    ).to_list(None)
+    await update_rankings()
+
+    await db["watermarks"].update_one(
+        {"_id": "joke_leaderboard"}, {"$set": {"at": until, "pending": None}}
+    )
+
+
+async def rebuild_leaderboard():
+    await db["joke_leaderboard"].delete_many({})
+    await db["watermarks"].delete_one({"_id": "joke_leaderboard"})
+    await refresh_leaderboard()
+
+
+@leader_only
+async def refresh_leaderboard_job(context: ContextTypes.DEFAULT_TYPE):
+    await refresh_leaderboard()
+
+
+def format_joke_preview(joke: dict) -> str:
+    if joke["kind"] == "text":
+        text = joke["text"].split("\n")[0]
+        return html.escape(text[:60] + "…" if len(text) > 60 else text)
+    return {"voice": "🎤 وویس", "video_note": "📹 ویدیو مسیج", "photo": "🖼 عکس"}.get(
+        joke["kind"], joke["kind"]
+    )
+
+
+@log_activity("top")
+async def top_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    assert update.message
+
+    # hidden jokes stay in the leaderboard, read a few extra to skip them
+    entries = (
+        await db["joke_leaderboard"]
+        .find({"votes": {"$gt": 0}})
+        .sort("bayesian_score", -1)
+        .limit(LEADERBOARD_TOP_SIZE * 3)
+        .to_list(None)
+    )
+    lines = []
+    for entry in entries:
+        joke = catalog.get(entry["joke_id"])
+        if joke is None:
+            continue
+        # mean is only set by update_rankings, a merged window may not have it yet
+        mean = entry["score_sum"] / entry["votes"]
+        lines.append(
+            f"{len(lines) + 1}. {format_joke_preview(joke)}\n"
+            f"      ⭐ {mean:.1f} از {entry['votes']} رای"
+            f" - <b>{html.escape(joke['creator_nickname'])}</b>"
+        )
+        if len(lines) >= LEADERBOARD_TOP_SIZE:
+            break
+
+    if not lines:
+        await update.message.reply_text("هنوز به هیچ جوکی رای داده نشده 🤷")
+        return
+
+    await update.message.reply_text("🏆 جوک‌های برتر\n\n" + "\n\n".join(lines))
+
+
+async def main(command: str):
+    # the merge needs the unique joke_id index, which a fresh database lacks
+    await create_indexes()
+
+    if command == "refresh":
+        await refresh_leaderboard()
+    elif command == "rebuild":
+        await rebuild_leaderboard()
+    else:
+        raise Exception("expected command to be one of 'refresh' or 'rebuild'")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "refresh"))
@@ -14,7 +14,9 @@ from telegram.ext import ContextTypes, ConversationHandler
 from obeyd.config import FILES_BASE_DIR, REVIEW_JOKES_CHAT_ID
 from obeyd.db import db
 from obeyd.jokes.functions import send_joke
+from obeyd.jokes.seen import next_joke_seq
 from obeyd.middlewares import authenticated, log_activity, user_has_nickname
+from obeyd.sender import Priority
 
 NEWJOKE_STATES_JOKE = 1
 NEWJOKE_STATES_JOKE_TEXT = 2
@@ -68,7 +70,10 @@ async def newjoke_callback_notify_admin(context: ContextTypes.DEFAULT_TYPE):
         user_id=None,
         chat_id=REVIEW_JOKES_CHAT_ID,
         context=context,
-        kwargs={"reply_markup": jokereview_inline_keyboard_markup(joke)},
+        kwargs={
+            "reply_markup": jokereview_inline_keyboard_markup(joke),
+            "rate_limit_args": Priority.NOTIFICATION,
+        },
     )
 
 
@@ -84,6 +89,7 @@ async def newjoke_handler_joke_text(
     joke = context.user_data.pop("joke")
     assert joke is not None
     joke["text"] = update.message.text
+    joke["seq"] = await next_joke_seq()
 
     await db["jokes"].insert_one(joke)
 
@@ -129,7 +135,13 @@ async def newjoke_handler_joke(
         file = await update.message.voice.get_file()
         file_id = str(uuid4())
         await file.download_to_drive(custom_path=f"{FILES_BASE_DIR}/{file_id}.bin")
-        joke.update({"kind": "voice", "file_id": file_id})
+        joke.update(
+            {
+                "kind": "voice",
+                "file_id": file_id,
+                "telegram_file_id": update.message.voice.file_id,
+            }
+        )
         context.user_data["joke"] = joke  # type: ignore
         await update.message.reply_text(
             "😂👍 میتونی توضیح کوتاهی هم در مورد وویسی که فرستادی بدی",
@@ -140,7 +152,13 @@ async def newjoke_handler_joke(
         file = await update.message.video_note.get_file()
         file_id = str(uuid4())
         await file.download_to_drive(custom_path=f"{FILES_BASE_DIR}/{file_id}.bin")
-        joke.update({"kind": "video_note", "file_id": file_id})
+        joke.update(
+            {
+                "kind": "video_note",
+                "file_id": file_id,
+                "telegram_file_id": update.message.video_note.file_id,
+            }
+        )
         context.user_data["joke"] = joke  # type: ignore
         await update.message.reply_text(
             "😂👍 میتونی توضیح کوتاهی هم در مورد ویدیو مسیجی که فرستادی بدی",
@@ -151,7 +169,13 @@ async def newjoke_handler_joke(
         file = await update.message.photo[-1].get_file()
         file_id = str(uuid4())
         await file.download_to_drive(custom_path=f"{FILES_BASE_DIR}/{file_id}.bin")
-        joke.update({"kind": "photo", "file_id": file_id})
+        joke.update(
+            {
+                "kind": "photo",
+                "file_id": file_id,
+                "telegram_file_id": update.message.photo[-1].file_id,
+            }
+        )
         context.user_data["joke"] = joke  # type: ignore
         await update.message.reply_text(
             "😂👍 میتونی توضیح کوتاهی هم در مورد عکسی که فرستادی بدی",
@@ -163,6 +187,7 @@ async def newjoke_handler_joke(
         {
             "kind": "text",
             "text": update.message.text,
+            "seq": await next_joke_seq(),
         }
     )
 
@@ -0,0 +1,58 @@
+from collections import deque
+from time import monotonic
+
+from telegram.ext import ContextTypes
+
+from obeyd.config import (
+    INLINE_POOL_LOW_WATER,
+    INLINE_POOL_MAX_AGE,
+    INLINE_POOL_SIZE,
+)
+from obeyd.jokes.thompson import thompson_sampled_jokes
+
+
+class JokePool:
+    def __init__(self, size: int, low_water: int, max_age: float):
+        self.size = size
+        self.low_water = low_water
+        self.max_age = max_age
+        self.jokes: deque[tuple[float, dict]] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self.jokes)
+
+    def pop(self) -> dict | None:
+        while self.jokes:
+            sampled_at, joke = self.jokes.popleft()
+            if monotonic() - sampled_at <= self.max_age:
+                return joke
+        return None
+
+    def drop_stale(self):
+        now = monotonic()
+        while self.jokes and now - self.jokes[0][0] > self.max_age:
+            self.jokes.popleft()
+
+    def needs_refill(self) -> bool:
+        return len(self.jokes) < self.low_water
+
+    def fill(self, jokes: list[dict]):
+        now = monotonic()
+        self.jokes.extend((now, joke) for joke in jokes)
+
+
+inline_pool = JokePool(
+    size=INLINE_POOL_SIZE,
+    low_water=INLINE_POOL_LOW_WATER,
+    max_age=INLINE_POOL_MAX_AGE,
+)
+
+
+async def refill_inline_pool(context: ContextTypes.DEFAULT_TYPE):
+    # entries are sampled in order, so the oldest ones are always at the front
+    inline_pool.drop_stale()
+    if not inline_pool.needs_refill():
+        return
+
+    jokes = await thompson_sampled_jokes(inline_pool.size - len(inline_pool))
+    inline_pool.fill(jokes)
@@ -1,17 +1,23 @@
+import asyncio
+import logging
 from datetime import datetime, time, timedelta, timezone
 
 import pytz
 from telegram import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
-from telegram.ext import ContextTypes, ConversationHandler
+from telegram.ext import ContextTypes, ConversationHandler, JobQueue
 
-from obeyd.config import RECURRING_INTERVALS
+from obeyd.config import RECURRING_DISPATCH_BATCH_SIZE, RECURRING_INTERVALS
 from obeyd.db import db
 from obeyd.jokes.functions import (
     scorejoke_inline_keyboard_markup,
-    select_joke_for,
+    select_jokes_for,
     send_joke,
 )
+from obeyd.lease import leader_only
 from obeyd.middlewares import log_activity
+from obeyd.sender import Priority
+
+logger = logging.getLogger(__name__)
 
 SETRECURRING_STATES_INTERVAL = 1
 
@@ -82,8 +88,6 @@ async def setrecurring_handler_interval(
         upsert=True,
     )
 
-    schedule_recurring(recurring, context)
-
     await update.message.reply_text(
         text=f"{interval['text']} همینجا جوک میفرستم 😁",
         reply_markup=ReplyKeyboardRemove(),
@@ -99,83 +103,94 @@ async def deleterecurring_handler(update: Update, context: ContextTypes.DEFAULT_
 
     chat_id = update.effective_chat.id
 
-    recurring = await db["recurrings"].find_one({"chat_id": chat_id})
-    if recurring is None:
+    result = await db["recurrings"].delete_one({"chat_id": chat_id})
+    if result.deleted_count == 0:
         await update.message.reply_text(
             "اصلا قرار نبود جوکی رو هر چند وقت یک بار بفرستم اینجا 🫤"
         )
         return
 
-    job_name = f"recurring-{recurring['chat_id']}"
-
-    assert context.job_queue
-    current_jobs = context.job_queue.get_jobs_by_name(name=job_name)
-
-    await db["recurrings"].delete_one({"chat_id": chat_id})
-    for job in current_jobs:
-        job.schedule_removal()
-
     await update.message.reply_text(text="باشه دیگه جوک نمیفرستم 😁")
 
 
-def schedule_recurring(recurring: dict, context: ContextTypes.DEFAULT_TYPE):
-    assert context.job_queue
-
-    job_name = f"recurring-{recurring['chat_id']}"
-
-    current_jobs = context.job_queue.get_jobs_by_name(name=job_name)
-    for job in current_jobs:
-        job.schedule_removal()
+def schedule_recurring_dispatchers(job_queue: JobQueue):
+    job_queue.run_daily(
+        dispatch_recurrings_callback,
+        data="daily",
+        time=time(hour=20, tzinfo=pytz.timezone("Asia/Tehran")),
+        name="recurrings-daily",
+    )
+    job_queue.run_daily(
+        dispatch_recurrings_callback,
+        data="weekly",
+        time=time(hour=20, tzinfo=pytz.timezone("Asia/Tehran")),
+        days=(4,),
+        name="recurrings-weekly",
+    )
+    job_queue.run_repeating(
+        dispatch_recurrings_callback,
+        data="minutely",
+        interval=timedelta(minutes=1),
+        name="recurrings-minutely",
+    )
 
-    if recurring["interval"] == "daily":
-        context.job_queue.run_daily(
-            recurring_joke_callback,
-            data=recurring,
-            time=time(hour=20, tzinfo=pytz.timezone("Asia/Tehran")),
-            name=job_name,
-        )
-    elif recurring["interval"] == "weekly":
-        context.job_queue.run_daily(
-            recurring_joke_callback,
-            data=recurring,
-            time=time(hour=20, tzinfo=pytz.timezone("Asia/Tehran")),
-            days=(4,),
-            name=job_name,
-        )
-    elif recurring["interval"] == "minutely":
-        context.job_queue.run_repeating(
-            recurring_joke_callback,
-            data=recurring,
-            interval=timedelta(minutes=1),
-            name=job_name,
-        )
 
+@leader_only
+async def dispatch_recurrings_callback(context: ContextTypes.DEFAULT_TYPE):
+    assert context.job
+    assert isinstance(context.job.data, str)
 
-async def schedule_recurrings(context: ContextTypes.DEFAULT_TYPE):
-    async for recurring in db["recurrings"].find():
-        schedule_recurring(recurring, context)
+    await dispatch_recurrings(context.job.data, context)
 
 
-async def recurring_joke_callback(context: ContextTypes.DEFAULT_TYPE):
-    assert context.job
+async def dispatch_recurrings(interval: str, context: ContextTypes.DEFAULT_TYPE):
+    recurrings = db["recurrings"].find(
+        {"interval": interval},
+        {"chat_id": 1, "chat_type": 1, "created_by_user_id": 1},
+        batch_size=RECURRING_DISPATCH_BATCH_SIZE,
+    )
 
-    recurring = context.job.data
-    assert isinstance(recurring, dict)
+    batch = []
+    async for recurring in recurrings:
+        batch.append(recurring)
+        if len(batch) >= RECURRING_DISPATCH_BATCH_SIZE:
+            await send_recurring_jokes(batch, context)
+            batch = []
+    if batch:
+        await send_recurring_jokes(batch, context)
 
-    chat_id = recurring["chat_id"]
-    chat_type = recurring["chat_type"]
-    created_by_user_id = recurring["created_by_user_id"]
 
-    joke = await select_joke_for(
-        user_id=created_by_user_id, chat_id=chat_id, chat_type=chat_type
+async def send_recurring_jokes(
+    recurrings: list[dict], context: ContextTypes.DEFAULT_TYPE
+):
+    jokes = await select_jokes_for(
+        [
+            (
+                recurring["chat_type"],
+                recurring["chat_id"],
+                recurring["created_by_user_id"],
+            )
+            for recurring in recurrings
+        ]
     )
-    if joke is None:
-        return
 
-    await send_joke(
-        joke=joke,
-        user_id=created_by_user_id,
-        chat_id=chat_id,
-        context=context,
-        kwargs={"reply_markup": scorejoke_inline_keyboard_markup(joke)},
+    results = await asyncio.gather(
+        *[
+            send_joke(
+                joke=joke,
+                user_id=recurring["created_by_user_id"],
+                chat_id=recurring["chat_id"],
+                context=context,
+                kwargs={
+                    "reply_markup": scorejoke_inline_keyboard_markup(joke),
+                    "rate_limit_args": Priority.RECURRING,
+                },
+            )
+            for recurring, joke in zip(recurrings, jokes)
+            if joke is not None
+        ],
+        return_exceptions=True,
     )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("failed to send recurring joke", exc_info=result)
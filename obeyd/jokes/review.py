@@ -1,10 +1,14 @@
 from bson import ObjectId
+from pymongo import ReturnDocument
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from obeyd.db import db
+from obeyd.jokes.catalog import catalog
 from obeyd.jokes.functions import format_text_joke
+from obeyd.jokes.seen import ensure_joke_seq
 from obeyd.middlewares import admin_only, log_activity
+from obeyd.sender import Priority
 
 
 async def update_joke_sent_to_admin(joke: dict, update: Update, accepted: bool):
@@ -39,7 +43,9 @@ async def reviewjoke_callback_notify_creator(context: ContextTypes.DEFAULT_TYPE)
     msg = "جوکت تایید شد 😁" if joke["accepted"] else "جوکت رد شد 😿"
 
     await context.bot.send_message(
-        chat_id=joke["creator_id"], text=f"{msg}\n\n{format_text_joke(joke)}"
+        chat_id=joke["creator_id"],
+        text=f"{msg}\n\n{format_text_joke(joke)}",
+        rate_limit_args=Priority.NOTIFICATION,
     )
 
 
@@ -64,12 +70,15 @@ async def reviewjoke_callback_query_handler(
     else:
         raise Exception("expected accept or reject")
 
-    await db["jokes"].update_one(
-        {"_id": joke_id}, {"$set": {"accepted": accepted, "visible": accepted}}
+    joke = await db["jokes"].find_one_and_update(
+        {"_id": joke_id},
+        {"$set": {"accepted": accepted, "visible": accepted}},
+        return_document=ReturnDocument.AFTER,
     )
-
-    joke = await db["jokes"].find_one({"_id": joke_id})
     assert joke is not None
+    if accepted:
+        await ensure_joke_seq(joke)
+    catalog.put(joke)
 
     if accepted:
         await update.callback_query.answer("تایید شد")
@@ -1,39 +1,19 @@
 from datetime import datetime, timezone
 
+import pymongo
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from obeyd.config import SCORES
+from obeyd.config import SCORES, VIEW_WRITE_TIMEOUT
 from obeyd.db import db
-from obeyd.jokes.functions import format_text_joke
+from obeyd.jokes.digest import buffer_score_event
+from obeyd.jokes.stats import record_score_stats
 from obeyd.middlewares import log_activity
 
 
-async def scorejoke_callback_notify_creator(context: ContextTypes.DEFAULT_TYPE):
-    assert context.job
-    assert isinstance(context.job.data, dict)
-
-    joke_score = context.job.data
-
-    joke = await db["jokes"].find_one({"_id": ObjectId(joke_score["joke_id"])})
-    scored_by_user = await db["users"].find_one({"user_id": joke_score["user_id"]})
-    assert joke
-
-    scored_by_user_nickname = None
-    if scored_by_user is not None and scored_by_user.get("nickname") is not None:
-        scored_by_user_nickname = scored_by_user["nickname"]
-
-    msg = SCORES[joke_score["score"]]["score_notif"].format(
-        s=scored_by_user_nickname if scored_by_user_nickname is not None else "ناشناسی"
-    )
-
-    if joke["kind"] == "text":
-        msg += f"\n\n{format_text_joke(joke)}"
-
-    await context.bot.send_message(chat_id=joke["creator_id"], text=msg)
-
-
 @log_activity("scorejoke")
 async def scorejoke_callback_query_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -46,32 +26,35 @@ async def scorejoke_callback_query_handler(
     joke_id = ObjectId(joke_id)
     score = int(score)
 
-    joke_score = {
-        "user_id": update.effective_user.id,
-        "joke_id": joke_id,
-        "score": score,
-    }
-
-    view = await db["joke_views"].find_one(
-        {"user_id": update.effective_user.id, "joke_id": joke_id}
-    )
-    if view is not None and view["score"] is not None:
+    # a view that is already scored doesn't match, so the upsert tries to
+    # insert a second view and hits the unique index
+    now = datetime.now(tz=timezone.utc)
+    try:
+        with pymongo.timeout(VIEW_WRITE_TIMEOUT):
+            view = await db["joke_views"].find_one_and_update(
+                {
+                    "user_id": update.effective_user.id,
+                    "joke_id": joke_id,
+                    "score": None,
+                },
+                {
+                    "$set": {"score": score, "scored_at": now},
+                    "$setOnInsert": {"viewed_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+    except DuplicateKeyError:
         await update.callback_query.answer("قبلا به این جوک رای دادی")
         return
 
-    now = datetime.now(tz=timezone.utc)
-    view = await db["joke_views"].update_one(
-        {"user_id": update.effective_user.id, "joke_id": joke_id},
-        {
-            "$set": {"score": int(score), "scored_at": now},
-            "$setOnInsert": {"viewed_at": now},
-        },
-    )
-
     await update.callback_query.answer(SCORES[score]["notif"])
-    assert context.job_queue
-    context.job_queue.run_once(
-        callback=scorejoke_callback_notify_creator,
-        when=0,
-        data=joke_score,
+
+    await record_score_stats(
+        update.effective_user.id,
+        joke_id,
+        score,
+        view.get("imputed_score") if view is not None else None,
     )
+
+    await buffer_score_event(joke_id, update.effective_user.id, score)
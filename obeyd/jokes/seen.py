@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import sys
+from typing import Any, Literal
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ReplaceOne, ReturnDocument
+
+from obeyd.cache import LRUCache
+from obeyd.config import SEEN_CACHE_SIZE, SEEN_CACHE_TTL
+from obeyd.db import db
+from obeyd.watch import watch_collection
+
+logger = logging.getLogger(__name__)
+
+SeenKind = Literal["user", "chat"]
+
+WORD_BITS = 32
+
+
+class SeenSet:
+    def __init__(self, words: np.ndarray | None = None):
+        self.words = words if words is not None else np.zeros(0, dtype=np.uint32)
+
+    @classmethod
+    def from_document(cls, doc: dict | None) -> "SeenSet":
+        if doc is None or not doc.get("words"):
+            return cls()
+        words = np.zeros(max(int(i) for i in doc["words"]) + 1, dtype=np.uint32)
+        for i, word in doc["words"].items():
+            words[int(i)] = word & 0xFFFFFFFF
+        return cls(words)
+
+    @classmethod
+    def from_seqs(cls, seqs: list[int]) -> "SeenSet":
+        seen = cls()
+        for seq in seqs:
+            seen.add(seq)
+        return seen
+
+    def to_words(self) -> dict[str, int]:
+        return {str(i): int(w) for i, w in enumerate(self.words) if w != 0}
+
+    def add(self, seq: int):
+        i, bit = divmod(seq, WORD_BITS)
+        if i >= len(self.words):
+            words = np.zeros(max(i + 1, 2 * len(self.words)), dtype=np.uint32)
+            words[: len(self.words)] = self.words
+            self.words = words
+        self.words[i] |= np.uint32(1 << bit)
+
+    def __contains__(self, seq: int) -> bool:
+        i, bit = divmod(seq, WORD_BITS)
+        return 0 <= seq and i < len(self.words) and bool(self.words[i] >> bit & 1)
+
+    def contains_many(self, seqs: np.ndarray) -> np.ndarray:
+        # seqs < 0 are jokes without a dense index, they are never seen
+        seqs = np.asarray(seqs, dtype=np.int64)
+        i = seqs // WORD_BITS
+        valid = (seqs >= 0) & (i < len(self.words))
+        result = np.zeros(len(seqs), dtype=bool)
+        result[valid] = (self.words[i[valid]] >> (seqs[valid] % WORD_BITS)) & 1 == 1
+        return result
+
+
+# other instances mark jokes seen too, their writes drop our copy through the
+# change stream, and the ttl bounds how stale a copy gets without one
+seen_cache: LRUCache[tuple[SeenKind, int], SeenSet] = LRUCache(
+    maxsize=SEEN_CACHE_SIZE, ttl=SEEN_CACHE_TTL
+)
+
+
+async def next_joke_seq() -> int:
+    counter = await db["counters"].find_one_and_update(
+        {"_id": "joke_seq"},
+        {"$inc": {"value": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["value"] - 1
+
+
+async def ensure_joke_seq(joke: dict) -> int:
+    if joke.get("seq") is None:
+        seq = await next_joke_seq()
+        result = await db["jokes"].find_one_and_update(
+            {"_id": joke["_id"], "seq": {"$exists": False}},
+            {"$set": {"seq": seq}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if result is None:
+            # somebody else assigned it first
+            result = await db["jokes"].find_one({"_id": joke["_id"]}, {"seq": 1})
+            assert result is not None
+        joke["seq"] = result["seq"]
+    return joke["seq"]
+
+
+async def get_seen_set(kind: SeenKind, owner_id: int) -> SeenSet:
+    seen = seen_cache.get((kind, owner_id))
+    if seen is None:
+        doc = await db["seen_jokes"].find_one({"kind": kind, "owner_id": owner_id})
+        seen = SeenSet.from_document(doc)
+        seen_cache.put((kind, owner_id), seen)
+    return seen
+
+
+async def get_seen_sets(keys: list[tuple[SeenKind, int]]) -> list[SeenSet]:
+    # the batch can be larger than the cache, so keep our own references
+    loaded: dict[tuple[SeenKind, int], SeenSet] = {}
+    missing: dict[SeenKind, set[int]] = {}
+    for kind, owner_id in keys:
+        seen = seen_cache.get((kind, owner_id))
+        if seen is not None:
+            loaded[(kind, owner_id)] = seen
+        else:
+            missing.setdefault(kind, set()).add(owner_id)
+
+    for kind, owner_ids in missing.items():
+        docs = db["seen_jokes"].find(
+            {"kind": kind, "owner_id": {"$in": list(owner_ids)}}
+        )
+        async for doc in docs:
+            loaded[(kind, doc["owner_id"])] = SeenSet.from_document(doc)
+        for owner_id in owner_ids:
+            seen = loaded.setdefault((kind, owner_id), SeenSet())
+            seen_cache.put((kind, owner_id), seen)
+
+    return [loaded[key] for key in keys]
+
+
+async def mark_seen(kind: SeenKind, owner_id: int, seq: int):
+    seen = seen_cache.get((kind, owner_id))
+    if seen is not None:
+        seen.add(seq)
+
+    i, bit = divmod(seq, WORD_BITS)
+    await db["seen_jokes"].update_one(
+        {"kind": kind, "owner_id": owner_id},
+        {"$bit": {f"words.{i}": {"or": 1 << bit}}},
+        upsert=True,
+    )
+
+
+async def rebuild_seen_sets():
+    jokes = await db["jokes"].find({}, {"seq": 1}).sort("created_at", 1).to_list(None)
+    for joke in jokes:
+        await ensure_joke_seq(joke)
+    seqs: dict[ObjectId, int] = {joke["_id"]: joke["seq"] for joke in jokes}
+
+    for kind, collection, owner_field in [
+        ("user", "joke_views", "user_id"),
+        ("chat", "joke_views_chat", "chat_id"),
+    ]:
+        groups = db[collection].aggregate(
+            [
+                {"$match": {owner_field: {"$ne": None}}},
+                {
+                    "$group": {
+                        "_id": f"${owner_field}",
+                        "joke_ids": {"$addToSet": "$joke_id"},
+                    }
+                },
+            ],
+            allowDiskUse=True,
+        )
+
+        requests = []
+        async for group in groups:
+            seen = SeenSet.from_seqs(
+                [seqs[joke_id] for joke_id in group["joke_ids"] if joke_id in seqs]
+            )
+            requests.append(
+                ReplaceOne(
+                    {"kind": kind, "owner_id": group["_id"]},
+                    {"kind": kind, "owner_id": group["_id"], "words": seen.to_words()},
+                    upsert=True,
+                )
+            )
+            if len(requests) >= 1000:
+                await db["seen_jokes"].bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            await db["seen_jokes"].bulk_write(requests, ordered=False)
+
+    seen_cache.clear()
+
+
+async def on_seen_change(change: dict[str, Any]):
+    doc = change.get("fullDocument")
+    if change["operationType"] in ["insert", "update", "replace"] and doc:
+        seen_cache.pop((doc["kind"], doc["owner_id"]))
+    else:
+        # deletes only carry the _id, we can't tell whose set it was
+        seen_cache.clear()
+
+
+async def resync_seen():
+    seen_cache.clear()
+
+
+async def watch_seen_jokes():
+    # without change streams, polling clears the cache every ttl seconds
+    await watch_collection(
+        db["seen_jokes"],
+        on_change=on_seen_change,
+        on_resync=resync_seen,
+        poll_interval=SEEN_CACHE_TTL,
+    )
+
+
+async def backfill_seen_sets():
+    # databases from before seen_jokes existed have views but no seen sets,
+    # without them every joke looks unseen
+    if await db["seen_jokes"].find_one({}, {"_id": 1}) is not None:
+        return
+    if (
+        await db["joke_views"].find_one({}, {"_id": 1}) is None
+        and await db["joke_views_chat"].find_one({}, {"_id": 1}) is None
+    ):
+        return
+    logger.info("seen_jokes is empty, rebuilding it from joke views")
+    await rebuild_seen_sets()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        raise Exception("expected command to be 'rebuild'")
+    asyncio.run(rebuild_seen_sets())
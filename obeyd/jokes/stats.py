@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import sys
+from typing import Any
+
+import numpy as np
+from bson import ObjectId
+
+from obeyd.config import JOKE_STATS_POLL_INTERVAL
+from obeyd.db import db
+from obeyd.watch import watch_collection
+
+logger = logging.getLogger(__name__)
+
+
+async def user_average_score(user_id: int) -> float | None:
+    stats = await db["user_score_stats"].find_one({"user_id": user_id})
+    if stats is None or stats["count"] == 0:
+        return None
+    return stats["sum"] / stats["count"]
+
+
+async def record_view_stats(joke_id: ObjectId, imputed_score: float | None):
+    # a view only counts as an observation once we can impute a score for it
+    if imputed_score is None:
+        return
+
+    await db["joke_stats"].update_one(
+        {"joke_id": joke_id},
+        {
+            "$inc": {
+                "count": 1,
+                "sum": imputed_score,
+                "sum_sq": imputed_score**2,
+            }
+        },
+        upsert=True,
+    )
+
+
+async def record_score_stats(
+    user_id: int, joke_id: ObjectId, score: int, imputed_score: float | None
+):
+    if imputed_score is None:
+        joke_inc = {"count": 1, "sum": score, "sum_sq": score**2}
+    else:
+        # replace the imputed observation with the real one
+        joke_inc = {
+            "sum": score - imputed_score,
+            "sum_sq": score**2 - imputed_score**2,
+        }
+
+    await asyncio.gather(
+        db["joke_stats"].update_one(
+            {"joke_id": joke_id}, {"$inc": joke_inc}, upsert=True
+        ),
+        db["user_score_stats"].update_one(
+            {"user_id": user_id}, {"$inc": {"count": 1, "sum": score}}, upsert=True
+        ),
+    )
+
+
+class JokeStatsTable:
+    # joke_stats mirrored in memory. the moments are kept in arrays aligned
+    # with a list of jokes (the catalog's), rebuilt when the catalog hands out
+    # a new list and otherwise updated in place as stats change
+    def __init__(self):
+        self.stats: dict[ObjectId, dict] = {}
+        self.joke_ids: dict[ObjectId, ObjectId] = {}
+        self._jokes: list[dict] | None = None
+        self._index: dict[ObjectId, int] = {}
+        self._moments = np.zeros((3, 0), dtype=np.float64)
+
+    def put(self, stats: dict):
+        self.stats[stats["joke_id"]] = stats
+        self.joke_ids[stats["_id"]] = stats["joke_id"]
+        i = self._index.get(stats["joke_id"])
+        if i is not None:
+            self._moments[:, i] = [stats["count"], stats["sum"], stats["sum_sq"]]
+
+    def remove(self, _id: ObjectId):
+        joke_id = self.joke_ids.pop(_id, None)
+        if joke_id is None:
+            return
+        self.stats.pop(joke_id, None)
+        i = self._index.get(joke_id)
+        if i is not None:
+            self._moments[:, i] = 0.0
+
+    def moments(self, jokes: list[dict]) -> np.ndarray:
+        # (count, sum, sum_sq) rows for the given jokes, a copy so it can be
+        # handed to the selection threads while the table keeps changing
+        if jokes is not self._jokes:
+            self._jokes = jokes
+            self._index = {joke["_id"]: i for i, joke in enumerate(jokes)}
+            self._moments = np.zeros((3, len(jokes)), dtype=np.float64)
+            for joke_id, stats in self.stats.items():
+                i = self._index.get(joke_id)
+                if i is not None:
+                    self._moments[:, i] = [
+                        stats["count"],
+                        stats["sum"],
+                        stats["sum_sq"],
+                    ]
+        return self._moments.copy()
+
+    async def reload(self):
+        stats = (
+            await db["joke_stats"]
+            .find({}, {"joke_id": 1, "count": 1, "sum": 1, "sum_sq": 1})
+            .to_list(None)
+        )
+        self.stats = {s["joke_id"]: s for s in stats}
+        self.joke_ids = {s["_id"]: s["joke_id"] for s in stats}
+        self._jokes = None
+
+    async def on_change(self, change: dict[str, Any]):
+        if change["operationType"] in ["insert", "update", "replace"]:
+            stats = change.get("fullDocument")
+            if stats is None:
+                self.remove(change["documentKey"]["_id"])
+            else:
+                self.put(stats)
+        elif change["operationType"] == "delete":
+            self.remove(change["documentKey"]["_id"])
+        elif change["operationType"] in ["drop", "rename", "invalidate"]:
+            # a rebuild replaces the collection
+            await self.reload()
+
+
+joke_stats_table = JokeStatsTable()
+
+
+async def watch_joke_stats():
+    await watch_collection(
+        db["joke_stats"],
+        on_change=joke_stats_table.on_change,
+        on_resync=joke_stats_table.reload,
+        poll_interval=JOKE_STATS_POLL_INTERVAL,
+    )
+
+
+def _joke_stats_pipeline() -> list[dict]:
+    return [
+        {
+            "$project": {
+                "joke_id": 1,
+                "value": {"$ifNull": ["$score", "$imputed_score"]},
+            }
+        },
+        {"$match": {"value": {"$ne": None}}},
+        {
+            "$group": {
+                "_id": "$joke_id",
+                "count": {"$sum": 1},
+                "sum": {"$sum": "$value"},
+                "sum_sq": {"$sum": {"$multiply": ["$value", "$value"]}},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "joke_id": "$_id",
+                "count": 1,
+                "sum": 1,
+                "sum_sq": 1,
+            }
+        },
+    ]
+
+
+async def rebuild_stats():
+    await db["joke_views"].aggregate(
+        [
+            {"$match": {"score": {"$ne": None}}},
+            {
+                "$group": {
+                    "_id": "$user_id",
+                    "count": {"$sum": 1},
+                    "sum": {"$sum": "$score"},
+                }
+            },
+            {"$project": {"_id": 0, "user_id": "$_id", "count": 1, "sum": 1}},
+            {"$out": "user_score_stats"},
+        ]
+    ).to_list(None)
+
+    # joke_views is only read: scored views count with their score, unscored
+    # ones with the score imputed when they were recorded. views from before
+    # imputation have none and only count once they are scored, the same as
+    # record_score_stats treats them
+    await db["joke_views"].aggregate(
+        _joke_stats_pipeline() + [{"$out": "joke_stats"}]
+    ).to_list(None)
+
+
+async def backfill_stats():
+    # databases from before joke_stats existed have views but no stats, the
+    # bot does this at startup so an upgrade needs no manual step
+    if await db["joke_stats"].find_one({}, {"_id": 1}) is not None:
+        return
+    if await db["joke_views"].find_one({}, {"_id": 1}) is None:
+        return
+    logger.info("joke_stats is empty, rebuilding it from joke_views")
+    await rebuild_stats()
+
+
+async def check_stats(tolerance: float = 1e-6) -> list[ObjectId]:
+    expected = {
+        s["joke_id"]: s
+        for s in await db["joke_views"].aggregate(_joke_stats_pipeline()).to_list(None)
+    }
+    stored = {s["joke_id"]: s async for s in db["joke_stats"].find({})}
+
+    drifted = []
+    for joke_id in set(expected) | set(stored):
+        e = expected.get(joke_id, {"count": 0, "sum": 0, "sum_sq": 0})
+        s = stored.get(joke_id, {"count": 0, "sum": 0, "sum_sq": 0})
+        if any(abs(e[k] - s[k]) > tolerance for k in ["count", "sum", "sum_sq"]):
+            drifted.append(joke_id)
+
+    return drifted
+
+
+async def main(command: str):
+    if command == "rebuild":
+        await rebuild_stats()
+    elif command == "check":
+        drifted = await check_stats()
+        for joke_id in drifted:
+            print(f"drifted: {joke_id}")
+        print(f"{len(drifted)} jokes drifted")
+        if drifted:
+            sys.exit(1)
+    else:
+        raise Exception("expected command to be one of 'rebuild' or 'check'")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "check"))
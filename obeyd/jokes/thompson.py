@@ -1,96 +1,189 @@
-from bson import ObjectId
 import numpy as np
 
-from obeyd.db import db
+from obeyd.config import SELECTION_CHUNK_SIZE
+from obeyd.jokes.catalog import catalog
+from obeyd.jokes.executor import selection_executor
+from obeyd.jokes.seen import SeenSet
+from obeyd.jokes.stats import joke_stats_table
 
 
 class ThompsonSampling:
     def __init__(self, n_arms, default_mean: float, default_var: float):
         self.n_arms = n_arms
-        self.observations = {i: [] for i in range(self.n_arms)}
+        self.counts = np.zeros(self.n_arms, dtype=np.int64)
+        self.means = np.zeros(self.n_arms, dtype=np.float64)
+        self.m2 = np.zeros(self.n_arms, dtype=np.float64)
         self.default_mean = default_mean
         self.default_var = default_var
 
-    def select_arm(self):
-        means = np.array(
-            [
-                (
-                    np.mean(self.observations[i])
-                    if self.observations[i]
-                    else self.default_mean
-                )
-                for i in range(self.n_arms)
-            ]
+    def _sample(
+        self, exclude: np.ndarray | None = None, n_draws: int | None = None
+    ) -> np.ndarray:
+        observed = self.counts > 0
+        means = np.where(observed, self.means, self.default_mean)
+        vars = np.where(
+            observed,
+            self.m2 / np.maximum(self.counts, 1),
+            self.default_var,
         )
-        vars = np.array(
-            [
-                (
-                    np.var(self.observations[i])
-                    if self.observations[i]
-                    else self.default_var
-                )
-                for i in range(self.n_arms)
-            ]
+
+        size = None if n_draws is None else (n_draws, self.n_arms)
+        sampled_values = np.random.normal(
+            means, np.sqrt(np.maximum(vars, 0.0)), size=size
         )
+        if exclude is not None:
+            sampled_values = np.where(exclude, -np.inf, sampled_values)
+        return sampled_values
+
+    def select_arm(self, exclude: np.ndarray | None = None):
+        return np.argmax(self._sample(exclude))
+
+    def select_arms(
+        self, n_draws: int, exclude: np.ndarray | None = None
+    ) -> np.ndarray:
+        # independent draws, exclude is either one mask or one mask per draw
+        return np.argmax(self._sample(exclude, n_draws=n_draws), axis=1)
 
-        sampled_values = np.random.normal(means, np.sqrt(vars))
-        return np.argmax(sampled_values)
+    def select_k(self, k: int, exclude: np.ndarray | None = None) -> np.ndarray:
+        sampled_values = self._sample(exclude)
+        k = min(k, int(np.isfinite(sampled_values).sum()))
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+        top = np.argpartition(-sampled_values, k - 1)[:k]
+        return top[np.argsort(-sampled_values[top])]
 
     def insert_observation(self, chosen_arm, value):
-        self.observations[chosen_arm].append(value)
+        # welford's online update
+        self.counts[chosen_arm] += 1
+        delta = value - self.means[chosen_arm]
+        self.means[chosen_arm] += delta / self.counts[chosen_arm]
+        self.m2[chosen_arm] += delta * (value - self.means[chosen_arm])
+
+    def insert_many(self, chosen_arms, values):
+        chosen_arms = np.asarray(chosen_arms, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+
+        counts = np.bincount(chosen_arms, minlength=self.n_arms)
+        sums = np.bincount(chosen_arms, weights=values, minlength=self.n_arms)
+        means = sums / np.maximum(counts, 1)
+        m2 = np.bincount(
+            chosen_arms,
+            weights=(values - means[chosen_arms]) ** 2,
+            minlength=self.n_arms,
+        )
+
+        self._merge(counts, means, m2)
+
+    def insert_moments(self, counts, sums, sums_sq):
+        counts = np.asarray(counts, dtype=np.int64)
+        sums = np.asarray(sums, dtype=np.float64)
+        sums_sq = np.asarray(sums_sq, dtype=np.float64)
+
+        means = sums / np.maximum(counts, 1)
+        m2 = np.maximum(sums_sq - counts * means**2, 0.0)
+
+        self._merge(counts, means, m2)
+
+    def _merge(self, counts: np.ndarray, means: np.ndarray, m2: np.ndarray):
+        # chan et al. pairwise combination of per-arm (count, mean, m2)
+        total = self.counts + counts
+        safe_total = np.maximum(total, 1)
+        delta = means - self.means
+
+        self.means += delta * counts / safe_total
+        self.m2 += m2 + delta**2 * self.counts * counts / safe_total
+        self.counts = total
+
+
+def thompson_from_moments(moments: np.ndarray) -> ThompsonSampling:
+    counts, sums, sums_sq = moments
+
+    thompson = ThompsonSampling(n_arms=len(counts), default_mean=3.0, default_var=2.0)
+    thompson.insert_moments(counts=counts, sums=sums, sums_sq=sums_sq)
+
+    return thompson
+
+
+def catalog_stats() -> tuple[list[dict], np.ndarray, np.ndarray]:
+    # the catalog replaces these lists instead of changing them, and the
+    # moments are a copy, so they can be handed to the selection threads
+    results = catalog.visible_jokes()
+    seqs = catalog.visible_seqs()
+    moments = joke_stats_table.moments(results)
+    return results, seqs, moments
+
+
+def sample_joke(
+    results: list[dict],
+    seqs: np.ndarray,
+    moments: np.ndarray,
+    exclude_jokes: SeenSet | None,
+) -> dict | None:
+    exclude = exclude_jokes.contains_many(seqs) if exclude_jokes is not None else None
+    if exclude is not None and exclude.all():
+        return None
+
+    thompson = thompson_from_moments(moments)
+    return results[int(thompson.select_arm(exclude))]
+
+
+def sample_jokes(results: list[dict], moments: np.ndarray, n: int) -> list[dict]:
+    thompson = thompson_from_moments(moments)
+
+    # a draw is a row of samples over every joke, so they are made in chunks
+    selected = []
+    for start in range(0, n, SELECTION_CHUNK_SIZE):
+        n_draws = min(SELECTION_CHUNK_SIZE, n - start)
+        selected.extend(results[int(i)] for i in thompson.select_arms(n_draws))
+    return selected
+
+
+def sample_jokes_for(
+    results: list[dict],
+    seqs: np.ndarray,
+    moments: np.ndarray,
+    exclude_jokes: list[SeenSet],
+) -> list[dict | None]:
+    thompson = thompson_from_moments(moments)
+
+    selected: list[dict | None] = []
+    for start in range(0, len(exclude_jokes), SELECTION_CHUNK_SIZE):
+        chunk = exclude_jokes[start : start + SELECTION_CHUNK_SIZE]
+        exclude = np.vstack([seen.contains_many(seqs) for seen in chunk])
+        selected.extend(
+            None if exclude[row].all() else results[int(i)]
+            for row, i in enumerate(thompson.select_arms(len(chunk), exclude))
+        )
+    return selected
 
 
 async def thompson_sampled_joke(
-    exclude_jokes: list[ObjectId] | None = None,
+    exclude_jokes: SeenSet | None = None,
 ) -> dict | None:
-    pipeline = [
-        {
-            "$match": {
-                "visible": True,
-                "_id": {"$nin": exclude_jokes or []},
-            }
-        },
-        {
-            "$lookup": {
-                "from": "joke_views",
-                "localField": "_id",
-                "foreignField": "joke_id",
-                "as": "views",
-            }
-        },
-    ]
-
-    results = await db.jokes.aggregate(pipeline).to_list(None)
-
-    if len(results) == 0:
+    if len(catalog.visible_jokes()) == 0:
         return None
 
-    thompson = ThompsonSampling(n_arms=len(results), default_mean=3.0, default_var=2.0)
-
-    average_user_score = {}
-    for joke in results:
-        for view in joke["views"]:
-            if "score" not in view or view["score"] is None:
-                continue
-            if view["user_id"] not in average_user_score:
-                average_user_score[view["user_id"]] = {"count": 0, "sum": 0}
-            average_user_score[view["user_id"]]["count"] += 1
-            average_user_score[view["user_id"]]["sum"] += view["score"]
-
-    for i, joke in enumerate(results):
-        for view in joke["views"]:
-            score = None
-            if "score" not in view or view["score"] is None:
-                if view["user_id"] in average_user_score:
-                    score = (
-                        average_user_score[view["user_id"]]["sum"]
-                        / average_user_score[view["user_id"]]["count"]
-                    )
-            else:
-                score = view["score"]
-            if score:
-                thompson.insert_observation(i, score)
-
-    selected_joke = results[int(thompson.select_arm())]
-
-    return selected_joke
+    results, seqs, moments = catalog_stats()
+    return await selection_executor.run(
+        sample_joke, results, seqs, moments, exclude_jokes
+    )
+
+
+async def thompson_sampled_jokes(n: int) -> list[dict]:
+    if n <= 0 or len(catalog.visible_jokes()) == 0:
+        return []
+
+    results, _, moments = catalog_stats()
+    return await selection_executor.run(sample_jokes, results, moments, n)
+
+
+async def thompson_sampled_jokes_for(
+    exclude_jokes: list[SeenSet],
+) -> list[dict | None]:
+    if len(exclude_jokes) == 0 or len(catalog.visible_jokes()) == 0:
+        return [None] * len(exclude_jokes)
+
+    results, seqs, moments = catalog_stats()
+    return await selection_executor.run(
+        sample_jokes_for, results, seqs, moments, exclude_jokes
+    )
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+from functools import wraps
+from time import monotonic, time
+from uuid import uuid4
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from telegram.ext import ContextTypes
+
+from obeyd.config import LEASE_RENEW_INTERVAL, LEASE_TTL
+from obeyd.db import db, is_scratch_db
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Lease:
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        # unique per lease object, so that one process can't hold a lease twice
+        self.holder = f"{INSTANCE_ID}:{uuid4().hex[:8]}"
+        # the fencing token grows every time the lease changes hands
+        self.token: int | None = None
+        self.deadline = 0.0
+
+    def is_held(self) -> bool:
+        return self.token is not None and monotonic() < self.deadline
+
+    async def acquire(self) -> bool:
+        # acquires the lease if it is free or expired, renews it if we hold it.
+        # expiry is judged by the server's clock, our own deadline starts
+        # before the request is sent so it always runs out first
+        started_at = monotonic()
+        try:
+            lease = await db["leases"].find_one_and_update(
+                {
+                    "_id": self.name,
+                    "$or": [
+                        {"holder": self.holder},
+                        {"$expr": {"$lte": ["$expires_at", "$$NOW"]}},
+                    ],
+                },
+                [
+                    {
+                        "$set": {
+                            "token": {
+                                "$cond": [
+                                    {"$eq": ["$holder", self.holder]},
+                                    "$token",
+                                    {"$add": [{"$ifNull": ["$token", 0]}, 1]},
+                                ]
+                            },
+                            "holder": self.holder,
+                            "expires_at": {"$add": ["$$NOW", int(self.ttl * 1000)]},
+                        }
+                    }
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # held by someone else, the upsert collided with their lease
+            self.token = None
+            return False
+
+        self.token = lease["token"]
+        self.deadline = started_at + self.ttl
+        return True
+
+    async def release(self):
+        if self.token is None:
+            return
+        self.token = None
+        # expire it right away instead of making the next holder wait for ttl
+        await db["leases"].update_one(
+            {"_id": self.name, "holder": self.holder},
+            {"$currentDate": {"expires_at": True}},
+        )
+
+    async def keep(self, renew_interval: float):
+        # tries to acquire and then renew the lease until cancelled
+        held = False
+        try:
+            while True:
+                try:
+                    await self.acquire()
+                except PyMongoError:
+                    # keep the lease until its deadline, the next renewal may work
+                    logger.exception(f"failed to renew lease {self.name}")
+
+                if self.is_held() != held:
+                    held = self.is_held()
+                    if held:
+                        logger.info(f"acquired lease {self.name} ({self.token})")
+                    else:
+                        logger.info(f"lost lease {self.name}")
+
+                await asyncio.sleep(renew_interval)
+        finally:
+            await asyncio.shield(self.release())
+
+
+async def fence(resource: str, token: int) -> bool:
+    # records the newest token that touched a resource, a holder whose lease
+    # was taken over is rejected here even if it still thinks it holds it
+    try:
+        await db["fences"].update_one(
+            {"_id": resource, "token": {"$lte": token}},
+            {"$set": {"token": token}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+leader_lease = Lease("leader", ttl=LEASE_TTL)
+
+
+async def keep_leadership():
+    await leader_lease.keep(LEASE_RENEW_INTERVAL)
+
+
+ingest_lease = Lease("ingest", ttl=LEASE_TTL)
+
+
+async def claim_ingestion():
+    # a second instance taking updates gets a Conflict from getUpdates in
+    # polling mode. in webhook mode it would run a chat's updates alongside
+    # the first one, chat ordering and the caches are per process
+    # a holder that crashed, such as this instance before a restart, lets the
+    # lease expire within its ttl
+    deadline = monotonic() + ingest_lease.ttl + LEASE_RENEW_INTERVAL
+    while not await ingest_lease.acquire():
+        if monotonic() > deadline:
+            raise Exception(
+                "expected no other instance to take updates, the ingest lease is held"
+            )
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+
+
+async def keep_ingestion():
+    # from the moment the lease is lost another instance may take updates, so
+    # this one shuts down the way it would on a SIGTERM
+    while True:
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+        try:
+            await ingest_lease.acquire()
+        except PyMongoError:
+            logger.exception("failed to renew lease ingest")
+        if not ingest_lease.is_held():
+            logger.error("lost the ingest lease, shutting down")
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+
+def leader_only(f):
+    # for jobs that must run on exactly one instance
+    @wraps(f)
+    async def g(context: ContextTypes.DEFAULT_TYPE):
+        token = leader_lease.token
+        if not leader_lease.is_held() or token is None:
+            return
+
+        if not await fence(f"job:{f.__name__}", token):
+            logger.warning(f"{f.__name__} fenced off, lease {token} is stale")
+            return
+
+        return await f(context)
+
+    return g
+
+
+async def contend(name: str, ttl: float):
+    # one contender of the demo, reports every 100ms until when it believes
+    # it holds the lease
+    lease = Lease(name, ttl=ttl)
+    keeper = asyncio.create_task(lease.keep(ttl / 4))
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+
+    while not stopping.is_set():
+        held = lease.is_held()
+        report = {
+            "pid": os.getpid(),
+            "token": lease.token if held else None,
+            "at": time(),
+            "until": time() + (lease.deadline - monotonic()) if held else None,
+        }
+        print(json.dumps(report), flush=True)
+        try:
+            await asyncio.wait_for(stopping.wait(), 0.1)
+        except asyncio.TimeoutError:
+            pass
+
+    keeper.cancel()
+    await asyncio.gather(keeper, return_exceptions=True)
+
+
+async def demo(contenders: int, ttl: float):
+    # runs contenders as separate processes, kills the leader and then stops
+    # the next one gracefully, measuring how long each failover takes
+    if not is_scratch_db():
+        raise Exception("expected MONGODB_URI to point at a *bench* or *test* database")
+
+    name = f"demo-{uuid4().hex[:8]}"
+    processes = {}
+    for _ in range(contenders):
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            __file__,
+            "contend",
+            name,
+            str(ttl),
+            stdout=asyncio.subprocess.PIPE,
+        )
+        processes[process.pid] = process
+
+    latest: dict[int, dict] = {}
+    overlaps = 0
+
+    async def follow(process: asyncio.subprocess.Process):
+        nonlocal overlaps
+        assert process.stdout
+        async for line in process.stdout:
+            report = json.loads(line)
+            if report["token"] is not None:
+                # anyone else who believed to hold the lease at this moment
+                for other in latest.values():
+                    if (
+                        other["pid"] != report["pid"]
+                        and other["token"] is not None
+                        and other["until"] > report["at"]
+                    ):
+                        overlaps += 1
+            latest[report["pid"]] = report
+
+    followers = [asyncio.create_task(follow(p)) for p in processes.values()]
+
+    async def next_leader(after: int) -> dict:
+        while True:
+            for report in latest.values():
+                if report["token"] is not None and report["token"] > after:
+                    return report
+            await asyncio.sleep(0.01)
+
+    leader = await next_leader(after=0)
+    print(f"{leader['pid']} leads with token {leader['token']}")
+
+    for how in ["kill", "terminate"]:
+        started_at = monotonic()
+        getattr(processes[leader["pid"]], how)()
+        leader = await next_leader(after=leader["token"])
+        print(
+            f"after {how}: {leader['pid']} leads with token {leader['token']}"
+            f" in {monotonic() - started_at:.2f}s"
+        )
+
+    for process in processes.values():
+        if process.returncode is None:
+            process.terminate()
+    await asyncio.gather(*[p.wait() for p in processes.values()])
+    await asyncio.gather(*followers)
+    await db["leases"].delete_one({"_id": name})
+
+    print(f"{overlaps} times two contenders held the lease at once")
+    if overlaps:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "contend":
+        asyncio.run(contend(sys.argv[2], float(sys.argv[3])))
+    else:
+        asyncio.run(
+            demo(
+                contenders=int(sys.argv[1]) if len(sys.argv) > 1 else 3,
+                ttl=float(sys.argv[2]) if len(sys.argv) > 2 else 2,
+            )
+        )
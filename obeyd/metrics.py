@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from time import monotonic
+from typing import Any, Callable
+
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+providers: dict[str, Callable[[], dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], dict[str, Any]]):
+    providers[name] = provider
+
+
+def collect_metrics() -> dict[str, dict[str, Any]]:
+    return {name: provider() for name, provider in providers.items()}
+
+
+async def log_metrics(context: ContextTypes.DEFAULT_TYPE):
+    for name, metrics in collect_metrics().items():
+        logger.info(f"{name}: {metrics}")
+
+
+class LoopLagMonitor:
+    # how late the event loop wakes up a sleeper, i.e. how long callbacks
+    # blocked it
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "mean_lag_ms": round(self.total_lag / max(self.samples, 1) * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+        }
+
+    async def run(self):
+        while True:
+            start = monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(monotonic() - start - self.interval, 0.0)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
@@ -5,14 +5,14 @@ from telegram import KeyboardButton, ReplyKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
 from obeyd.activities import log_activity_custom
-from obeyd.db import db
+from obeyd.user_cache import admin_cache, get_user
 
 
 def log_activity(kind, data: Optional[dict[str, Any]] = None):
     def g(f):
         @wraps(f)
         async def h(update: Update, context: ContextTypes.DEFAULT_TYPE, **kwargs):
-            await log_activity_custom(update, kind, data)
+            log_activity_custom(update, kind, data)
             return await f(update, context, **kwargs)
 
         return h
@@ -25,7 +25,7 @@ def not_authenticated(f):
     async def g(update: Update, context: ContextTypes.DEFAULT_TYPE):
         assert update.effective_user
 
-        user = await db["users"].find_one({"user_id": update.effective_user.id})
+        user = await get_user(update.effective_user.id)
 
         if user is not None:
             if update.message:
@@ -49,7 +49,7 @@ def authenticated(f):
     async def g(update: Update, context: ContextTypes.DEFAULT_TYPE):
         assert update.effective_user
 
-        user = await db["users"].find_one({"user_id": update.effective_user.id})
+        user = await get_user(update.effective_user.id)
 
         if user is None:
             if update.message:
@@ -93,10 +93,7 @@ def admin_only(f):
     async def g(update: Update, context: ContextTypes.DEFAULT_TYPE):
         assert update.effective_user
 
-        admins = db["users"].find({"is_admin": True})
-        admins = [admin["user_id"] async for admin in admins]
-
-        if update.effective_user.id not in admins:
+        if update.effective_user.id not in admin_cache:
             msg = "شما ادمین نیستید 😢"
             if update.message:
                 await update.message.reply_text(text=msg)
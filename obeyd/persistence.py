@@ -0,0 +1,300 @@
+import asyncio
+import logging
+from copy import deepcopy
+from typing import Any
+
+from pymongo import ReplaceOne
+from pymongo.errors import PyMongoError
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+from obeyd.config import PERSISTENCE_POLL_INTERVAL
+from obeyd.db import db
+from obeyd.lease import INSTANCE_ID
+from obeyd.watch import watch_collection
+
+logger = logging.getLogger(__name__)
+
+shared_conversations: dict[str, "SharedConversationHandler"] = {}
+
+
+class SharedConversationHandler(ConversationHandler):
+    # a persistent conversation whose states another instance may change,
+    # python-telegram-bot only reads them once at startup
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        shared_conversations[self.name] = self
+
+    def load_state(self, key: tuple, state: object | None):
+        # tracked like a change of our own, the persistence already has the
+        # state so handing it back doesn't write it again
+        self._update_state(self.END if state is None else state, key)
+
+
+class MongoPersistence(BasePersistence):
+    # the application hands us changed user_data and conversation states once
+    # every update_interval seconds, we keep them in memory and write each
+    # round to mongo in one batch, so a crash loses at most one interval.
+    # documents are replaced rather than deleted and carry the instance that
+    # wrote them, writes of other instances are followed through a change
+    # stream (or polled) and loaded unless we have a newer one of our own
+
+    def __init__(self, update_interval: float):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.user_data: dict[int, dict] | None = None
+        self.conversations: dict[str, dict[tuple, object]] = {}
+
+        self.dirty_users: set[int] = set()
+        self.dirty_conversations: set[tuple[str, tuple]] = set()
+        self.writing_users: set[int] = set()
+        self.writing_conversations: set[tuple[str, tuple]] = set()
+        # loaded from another instance, the application's copy is refreshed
+        # before the user's next update
+        self.stale_users: set[int] = set()
+        self.write_task: asyncio.Task | None = None
+
+        self.written = 0
+        self.failed = 0
+        self.loaded = 0
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "dirty": len(self.dirty_users) + len(self.dirty_conversations),
+            "written": self.written,
+            "failed": self.failed,
+            "loaded": self.loaded,
+        }
+
+    async def get_user_data(self) -> dict[int, dict]:
+        if self.user_data is None:
+            self.user_data = {
+                doc["_id"]: doc["data"]
+                async for doc in db["persistence_user_data"].find({})
+            }
+        return deepcopy(self.user_data)
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict[tuple, object]:
+        if name not in self.conversations:
+            self.conversations[name] = {
+                tuple(doc["key"]): doc["state"]
+                async for doc in db["persistence_conversations"].find(
+                    {"name": name, "state": {"$ne": None}}
+                )
+            }
+        return dict(self.conversations[name])
+
+    async def update_conversation(
+        self, name: str, key: tuple[int | str, ...], new_state: object | None
+    ):
+        conversations = self.conversations.setdefault(name, {})
+        if conversations.get(key) == new_state:
+            return
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self.dirty_conversations.add((name, key))
+        self.schedule_write()
+
+    async def update_user_data(self, user_id: int, data: dict):
+        if self.user_data is None:
+            self.user_data = {}
+        if self.user_data.get(user_id) == data:
+            return
+        self.user_data[user_id] = deepcopy(data)
+        self.dirty_users.add(user_id)
+        self.schedule_write()
+
+    async def drop_user_data(self, user_id: int):
+        if self.user_data is not None:
+            self.user_data.pop(user_id, None)
+        self.dirty_users.add(user_id)
+        self.schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data: Any):
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id not in self.stale_users:
+            return
+        self.stale_users.discard(user_id)
+        user_data.clear()
+        user_data.update(deepcopy((self.user_data or {}).get(user_id, {})))
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def watch(self):
+        await asyncio.gather(
+            watch_collection(
+                db["persistence_user_data"],
+                on_change=self.on_user_data_change,
+                on_resync=self.resync_user_data,
+                poll_interval=PERSISTENCE_POLL_INTERVAL,
+            ),
+            watch_collection(
+                db["persistence_conversations"],
+                on_change=self.on_conversation_change,
+                on_resync=self.resync_conversations,
+                poll_interval=PERSISTENCE_POLL_INTERVAL,
+            ),
+        )
+
+    async def on_user_data_change(self, change: dict[str, Any]):
+        if change["operationType"] in ["insert", "update", "replace"]:
+            if change.get("fullDocument") is not None:
+                self.load_user_data(change["fullDocument"])
+        elif change["operationType"] in ["drop", "rename", "invalidate"]:
+            await self.resync_user_data()
+
+    async def resync_user_data(self):
+        async for doc in db["persistence_user_data"].find(
+            {"instance": {"$ne": INSTANCE_ID}}
+        ):
+            self.load_user_data(doc)
+
+    def load_user_data(self, doc: dict):
+        user_id = doc["_id"]
+        if doc.get("instance") == INSTANCE_ID:
+            return
+        # our own change is newer, it overwrites this one when it is written
+        if user_id in self.dirty_users or user_id in self.writing_users:
+            return
+        if self.user_data is None:
+            self.user_data = {}
+        if self.user_data.get(user_id, {}) == doc["data"]:
+            return
+        self.user_data[user_id] = doc["data"]
+        self.stale_users.add(user_id)
+        self.loaded += 1
+
+    async def on_conversation_change(self, change: dict[str, Any]):
+        if change["operationType"] in ["insert", "update", "replace"]:
+            if change.get("fullDocument") is not None:
+                self.load_conversation(change["fullDocument"])
+        elif change["operationType"] in ["drop", "rename", "invalidate"]:
+            await self.resync_conversations()
+
+    async def resync_conversations(self):
+        async for doc in db["persistence_conversations"].find(
+            {"instance": {"$ne": INSTANCE_ID}}
+        ):
+            self.load_conversation(doc)
+
+    def load_conversation(self, doc: dict):
+        name, key, state = doc["name"], tuple(doc["key"]), doc["state"]
+        if doc.get("instance") == INSTANCE_ID:
+            return
+        conversation = (name, key)
+        if (
+            conversation in self.dirty_conversations
+            or conversation in self.writing_conversations
+        ):
+            return
+        conversations = self.conversations.setdefault(name, {})
+        if conversations.get(key) == state:
+            return
+        if state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = state
+        handler = shared_conversations.get(name)
+        if handler is not None:
+            handler.load_state(key, state)
+        self.loaded += 1
+
+    async def flush(self):
+        if self.write_task is not None:
+            await self.write_task
+        await self.write_dirty()
+
+    def schedule_write(self):
+        if self.write_task is None or self.write_task.done():
+            self.write_task = asyncio.create_task(self.write_dirty())
+
+    async def write_dirty(self):
+        # the application updates us with concurrent calls, let the rest of
+        # them land before writing
+        await asyncio.sleep(0)
+
+        # changes that arrive while a batch is written go out right after it
+        while self.dirty_users or self.dirty_conversations:
+            if not await self.write_batch():
+                return
+
+    async def write_batch(self) -> bool:
+        dirty_users, self.dirty_users = self.dirty_users, set()
+        dirty_conversations, self.dirty_conversations = self.dirty_conversations, set()
+        self.writing_users = dirty_users
+        self.writing_conversations = dirty_conversations
+
+        # a dropped user or an ended conversation is written as empty, a
+        # delete would not tell the other instances who made it
+        user_data = self.user_data or {}
+        user_ops = [
+            ReplaceOne(
+                {"_id": user_id},
+                {"data": user_data.get(user_id, {}), "instance": INSTANCE_ID},
+                upsert=True,
+            )
+            for user_id in dirty_users
+        ]
+        conversation_ops = [
+            ReplaceOne(
+                {"_id": f"{name}:{':'.join(str(k) for k in key)}"},
+                {
+                    "name": name,
+                    "key": list(key),
+                    "state": self.conversations.get(name, {}).get(key),
+                    "instance": INSTANCE_ID,
+                },
+                upsert=True,
+            )
+            for name, key in dirty_conversations
+        ]
+
+        try:
+            if user_ops:
+                await db["persistence_user_data"].bulk_write(user_ops, ordered=False)
+            if conversation_ops:
+                await db["persistence_conversations"].bulk_write(
+                    conversation_ops, ordered=False
+                )
+        except PyMongoError:
+            # retried with the next round, the in-memory copy is still current
+            logger.exception("failed to write persistence")
+            self.failed += 1
+            self.dirty_users |= dirty_users
+            self.dirty_conversations |= dirty_conversations
+            return False
+        finally:
+            self.writing_users = set()
+            self.writing_conversations = set()
+
+        self.written += len(user_ops) + len(conversation_ops)
+        return True
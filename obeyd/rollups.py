@@ -0,0 +1,85 @@
+import asyncio
+import sys
+from datetime import datetime
+from typing import Any
+
+from pymongo import UpdateOne
+
+from obeyd.db import db
+from obeyd.hll import hll_register
+
+
+def rollup_buckets(created_at: datetime) -> list[tuple[str, datetime]]:
+    hour = created_at.replace(minute=0, second=0, microsecond=0)
+    return [("hour", hour), ("day", hour.replace(hour=0))]
+
+
+def rollup_updates(activities: list[dict[str, Any]]) -> list[UpdateOne]:
+    counts: dict[tuple, float] = {}
+    registers: dict[tuple, dict[str, int]] = {}
+
+    for activity in activities:
+        weight = activity.get("sample_weight", 1)
+        register = (
+            hll_register(activity["user_id"])
+            if activity.get("user_id") is not None
+            else None
+        )
+        for granularity, bucket in rollup_buckets(activity["created_at"]):
+            key = (activity["kind"], activity.get("chat_type"), granularity, bucket)
+            counts[key] = counts.get(key, 0) + weight
+            key_registers = registers.setdefault(key, {})
+            if register is not None:
+                index, rank = register
+                key_registers[str(index)] = max(key_registers.get(str(index), 0), rank)
+
+    updates = []
+    for key, count in counts.items():
+        kind, chat_type, granularity, bucket = key
+        update: dict[str, Any] = {"$inc": {"count": count}}
+        if registers[key]:
+            update["$max"] = {
+                f"hll.{index}": rank for index, rank in registers[key].items()
+            }
+        updates.append(
+            UpdateOne(
+                {
+                    "kind": kind,
+                    "chat_type": chat_type,
+                    "granularity": granularity,
+                    "bucket": bucket,
+                },
+                update,
+                upsert=True,
+            )
+        )
+    return updates
+
+
+async def record_rollups(activities: list[dict[str, Any]]):
+    updates = rollup_updates(activities)
+    if updates:
+        await db["activity_rollups"].bulk_write(updates, ordered=False)
+
+
+async def rebuild_rollups(batch_size: int = 5000):
+    await db["activity_rollups"].delete_many({})
+
+    batch = []
+    async for activity in db["activities"].find(
+        {},
+        {"kind": 1, "chat_type": 1, "user_id": 1, "created_at": 1, "sample_weight": 1},
+        batch_size=batch_size,
+    ):
+        batch.append(activity)
+        if len(batch) >= batch_size:
+            await record_rollups(batch)
+            batch = []
+    if batch:
+        await record_rollups(batch)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        raise Exception("expected command to be 'rebuild'")
+    asyncio.run(rebuild_rollups())
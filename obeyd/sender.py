@@ -0,0 +1,225 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+from collections import deque
+from enum import IntEnum
+from time import monotonic
+from typing import Any, Callable, Coroutine
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from obeyd.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+    RECURRING = 2
+    BROADCAST = 3
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+    def delay(self) -> float:
+        if (paused_for := self.paused_until - monotonic()) > 0:
+            return paused_for
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    async def acquire(self):
+        while (delay := self.delay()) > 0:
+            await asyncio.sleep(delay)
+        self.consume()
+
+
+class PriorityRateLimiter(BaseRateLimiter[Priority]):
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        group_rate: float,
+        max_retries: int,
+        max_chat_buckets: int = 10000,
+        flood_window: float = 10.0,
+        flood_chats: int = 3,
+    ):
+        self.global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.chat_buckets: LRUCache[int | str, TokenBucket] = LRUCache(
+            maxsize=max_chat_buckets
+        )
+
+        # waiters for the global bucket, served in (priority, arrival) order
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+        self.pump_task: asyncio.Task | None = None
+        self.paused_until = 0.0
+        # flood waits of this many chats within flood_window seconds are taken
+        # as the bot's own limit rather than the chats'
+        self.flood_window = flood_window
+        self.flood_chats = flood_chats
+        self.chat_flood_waits: deque[tuple[float, int | str]] = deque()
+
+        self.queued = {priority.name: 0 for priority in Priority}
+        self.sent = {priority.name: 0 for priority in Priority}
+        self.retried = 0
+        self.failed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self.pump_task is not None:
+            self.pump_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.pump_task
+            self.pump_task = None
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "queued": dict(self.queued),
+            "sent": dict(self.sent),
+            "retried": self.retried,
+            "failed": self.failed,
+            "paused_for": max(self.paused_until - monotonic(), 0.0),
+            "paused_chats": sum(
+                1
+                for _, bucket in self.chat_buckets.items.values()
+                if bucket.paused_until > monotonic()
+            ),
+        }
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # string chat ids only work for channels and supergroups
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(rate=self.group_rate, capacity=3)
+            else:
+                bucket = TokenBucket(rate=self.chat_rate, capacity=3)
+            self.chat_buckets.put(chat_id, bucket)
+        return bucket
+
+    def _flood_wait(self, chat_id: int | str | None, retry_after: float):
+        if chat_id is not None:
+            self._chat_bucket(chat_id).pause(retry_after)
+
+            now = monotonic()
+            self.chat_flood_waits.append((now, chat_id))
+            while self.chat_flood_waits[0][0] < now - self.flood_window:
+                self.chat_flood_waits.popleft()
+            chats = {chat for _, chat in self.chat_flood_waits}
+            if len(chats) < self.flood_chats:
+                return
+
+        self.paused_until = max(self.paused_until, monotonic() + retry_after)
+
+    async def _acquire_global(self, priority: Priority):
+        if (
+            not self.waiters
+            and monotonic() >= self.paused_until
+            and self.global_bucket.delay() == 0
+        ):
+            self.global_bucket.consume()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        self.queued[priority.name] += 1
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.create_task(self._pump())
+        try:
+            await future
+        finally:
+            self.queued[priority.name] -= 1
+
+    async def _pump(self):
+        while self.waiters:
+            if (paused_for := self.paused_until - monotonic()) > 0:
+                await asyncio.sleep(paused_for)
+                continue
+            if (delay := self.global_bucket.delay()) > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                # the waiting request was cancelled
+                continue
+            self.global_bucket.consume()
+            future.set_result(None)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict | list[dict]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: Priority | None,
+    ) -> bool | dict | list[dict]:
+        priority = (
+            rate_limit_args if rate_limit_args is not None else Priority.INTERACTIVE
+        )
+
+        chat_id = data.get("chat_id")
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)  # type: ignore
+
+        attempt = 0
+        while True:
+            # requests that are not addressed to a chat (e.g. answering
+            # callback and inline queries) are only held back by flood waits
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+                await self._acquire_global(priority)
+            elif (paused_for := self.paused_until - monotonic()) > 0:
+                await asyncio.sleep(paused_for)
+
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                # a flood wait of one chat only holds back that chat
+                self._flood_wait(chat_id, retry_after)
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    logger.error(f"{endpoint} to {chat_id} hit flood wait too often")
+                    raise
+                attempt += 1
+                self.retried += 1
+                logger.info(f"{endpoint} to {chat_id} hit flood wait {retry_after}s")
+                continue
+
+            self.sent[priority.name] += 1
+            return result
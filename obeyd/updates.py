@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def update_key(update: object) -> int | None:
+    # conversation state is kept per chat and user, so serializing per chat
+    # (or per user when there is no chat, e.g. inline queries) is enough
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+
+# bounds only the updates the application has handed over, running or waiting
+MAX_PENDING_UPDATES = 2**16
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int):
+        # the base class takes its slot before do_process_update, so an update
+        # waiting for its chat would hold one, the real cap is taken after the
+        # chat lock instead
+        super().__init__(MAX_PENDING_UPDATES)
+        self.concurrency = max_concurrent_updates
+        self.semaphore = asyncio.Semaphore(max_concurrent_updates)
+        self.locks: dict[int, asyncio.Lock] = {}
+        self.pending: dict[int, int] = {}
+        self.in_flight = 0
+        self.processed = 0
+        self.serialized = 0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        key = update_key(update)
+        self.in_flight += 1
+        try:
+            if key is None:
+                async with self.semaphore:
+                    await coroutine
+                return
+
+            lock = self.locks.setdefault(key, asyncio.Lock())
+            self.pending[key] = self.pending.get(key, 0) + 1
+            if lock.locked():
+                self.serialized += 1
+            try:
+                # asyncio.Lock wakes waiters in arrival order, so updates of a
+                # chat are handled in the order they were received
+                async with lock, self.semaphore:
+                    await coroutine
+            finally:
+                self.pending[key] -= 1
+                if self.pending[key] == 0:
+                    del self.pending[key]
+                    del self.locks[key]
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "keys": len(self.locks),
+            "processed": self.processed,
+            "serialized": self.serialized,
+        }
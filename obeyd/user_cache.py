@@ -0,0 +1,78 @@
+from typing import Any
+
+from telegram.ext import ContextTypes
+
+from obeyd.cache import LRUCache
+from obeyd.config import USER_CACHE_SIZE, USER_CACHE_TTL
+from obeyd.db import db
+from obeyd.watch import watch_collection
+
+# users that are not registered are cached as None
+user_cache: LRUCache[int, dict | None] = LRUCache(
+    maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL
+)
+
+_MISSING = object()
+
+
+class AdminCache:
+    def __init__(self):
+        self.ids: set[int] = set()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.ids
+
+    async def refresh(self):
+        admins = db["users"].find({"is_admin": True}, {"user_id": 1})
+        self.ids = {admin["user_id"] async for admin in admins}
+
+    def update(self, user: dict):
+        if user.get("is_admin") is True:
+            self.ids.add(user["user_id"])
+        else:
+            self.ids.discard(user["user_id"])
+
+
+admin_cache = AdminCache()
+
+
+async def get_user(user_id: int) -> dict | None:
+    user = user_cache.get(user_id, _MISSING)
+    if user is _MISSING:
+        user = await db["users"].find_one({"user_id": user_id})
+        user_cache.put(user_id, user)
+    return user
+
+
+def cache_user(user: dict):
+    user_cache.put(user["user_id"], user)
+
+
+async def on_user_change(change: dict[str, Any]):
+    user = change.get("fullDocument")
+    if change["operationType"] in ["insert", "update", "replace"] and user:
+        cache_user(user)
+        admin_cache.update(user)
+    else:
+        # deletes only carry the _id, we can't tell which user_id it was
+        user_cache.clear()
+        await admin_cache.refresh()
+
+
+async def resync_users():
+    user_cache.clear()
+    await admin_cache.refresh()
+
+
+async def refresh_admins(context: ContextTypes.DEFAULT_TYPE):
+    await admin_cache.refresh()
+
+
+async def watch_users():
+    # without change streams, polling clears the cache every ttl seconds
+    await watch_collection(
+        db["users"],
+        on_change=on_user_change,
+        on_resync=resync_users,
+        poll_interval=USER_CACHE_TTL,
+    )
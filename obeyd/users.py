@@ -12,6 +12,7 @@ from obeyd.middlewares import (
     not_authenticated,
     user_has_nickname,
 )
+from obeyd.user_cache import cache_user
 
 START_STATES_NAME = 1
 SETNAME_STATES_NAME = 1
@@ -40,14 +41,14 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     assert update.message
     assert update.effective_user
 
-    await db["users"].insert_one(
-        {
-            "user_id": update.effective_user.id,
-            "user_name": update.effective_user.username,
-            "user_fullname": update.effective_user.full_name,
-            "joined_at": datetime.now(tz=pytz.timezone("Asia/Tehran")),
-        },
-    )
+    user = {
+        "user_id": update.effective_user.id,
+        "user_name": update.effective_user.username,
+        "user_fullname": update.effective_user.full_name,
+        "joined_at": datetime.now(tz=pytz.timezone("Asia/Tehran")),
+    }
+    await db["users"].insert_one(user)
+    cache_user(user)
 
     await update.message.reply_text(
         "به به خوش اومدی 😀 برای اینکه برات جوک بفرستم از دستور /joke استفاده کن",
@@ -116,6 +117,8 @@ async def setname_handler_name(
         )
         return SETNAME_STATES_NAME
 
+    cache_user({**user, "nickname": chosen_nickname})
+
     await update.message.reply_text(
         f"سلام <b>{chosen_nickname}</b> 🫡 برای اینکه برات جوک بفرستم از دستور /joke استفاده کن 🙂",
         reply_markup=ReplyKeyboardRemove(),
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_NOT_SUPPORTED = 40573
+
+
+async def watch_collection(
+    collection: AsyncIOMotorCollection,
+    on_change: Callable[[dict[str, Any]], Awaitable[None]],
+    on_resync: Callable[[], Awaitable[None]],
+    poll_interval: float,
+):
+    while True:
+        try:
+            async with collection.watch(full_document="updateLookup") as stream:
+                # resync after the stream is open so no change falls in between
+                await on_resync()
+                async for change in stream:
+                    await on_change(change)
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAMS_NOT_SUPPORTED:
+                logger.exception(f"change stream on {collection.name} failed")
+                await asyncio.sleep(poll_interval)
+                continue
+            logger.info(
+                f"change streams are not supported, polling {collection.name} every {poll_interval}s"
+            )
+            await poll_collection(collection, on_resync, poll_interval)
+        except PyMongoError:
+            logger.exception(f"change stream on {collection.name} failed")
+            await asyncio.sleep(poll_interval)
+
+
+async def poll_collection(
+    collection: AsyncIOMotorCollection,
+    on_resync: Callable[[], Awaitable[None]],
+    poll_interval: float,
+):
+    while True:
+        try:
+            await on_resync()
+        except PyMongoError:
+            logger.exception(f"polling {collection.name} failed")
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,140 @@
+import asyncio
+import hmac
+import json
+import logging
+from typing import Any
+
+import uvicorn
+from telegram import Update
+from telegram.ext import Application
+
+from obeyd.config import (
+    WEBHOOK_HOST,
+    WEBHOOK_MAX_BODY_SIZE,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookIngest:
+    # a bare asgi app that feeds telegram's webhook posts into the
+    # application's update queue
+
+    def __init__(self, application: Application, path: str, secret_token: str):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token.encode()
+
+        self.accepted = 0
+        self.shed = 0
+        self.forbidden = 0
+        self.invalid = 0
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "queued": self.application.update_queue.qsize(),
+            "accepted": self.accepted,
+            "shed": self.shed,
+            "forbidden": self.forbidden,
+            "invalid": self.invalid,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+
+        if scope["path"] != self.path:
+            return await self.respond(send, 404)
+        if scope["method"] != "POST":
+            return await self.respond(send, 405)
+
+        headers = dict(scope["headers"])
+        token = headers.get(b"x-telegram-bot-api-secret-token", b"")
+        if not hmac.compare_digest(token, self.secret_token):
+            self.forbidden += 1
+            return await self.respond(send, 403)
+
+        body = await self.read_body(receive)
+        if body is None:
+            self.invalid += 1
+            return await self.respond(send, 413)
+
+        # anything that does not parse as an update is the sender's fault,
+        # de_json fails with all sorts of errors on json of the wrong shape
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception:
+            update = None
+        if update is None:
+            self.invalid += 1
+            return await self.respond(send, 400)
+
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # telegram redelivers updates that were not answered with 2xx,
+            # so a full queue pushes the backlog back onto telegram
+            self.shed += 1
+            return await self.respond(send, 503)
+
+        self.accepted += 1
+        await self.respond(send, 200)
+
+    async def read_body(self, receive) -> bytes | None:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > WEBHOOK_MAX_BODY_SIZE:
+                return None
+            if not message.get("more_body", False):
+                return body
+
+    async def respond(self, send, status: int):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def run_webhook(application: Application, ingest: WebhookIngest):
+    if not WEBHOOK_URL:
+        raise Exception("expected OBEYD_WEBHOOK_URL to be set in webhook mode")
+    if not WEBHOOK_SECRET_TOKEN:
+        raise Exception("expected OBEYD_WEBHOOK_SECRET_TOKEN to be set in webhook mode")
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            ingest,
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            lifespan="off",
+            log_level="warning",
+        )
+    )
+
+    async with application:
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await application.start()
+        logger.info(f"serving webhook on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+        try:
+            # returns once the server gets SIGINT or SIGTERM
+            await server.serve()
+        finally:
+            await application.stop()
+            if application.post_shutdown is not None:
+                await application.post_shutdown(application)